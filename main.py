@@ -1,12 +1,16 @@
+import logging
 import os
 import sys
 import time
 from typing import Tuple
 
+from orchestrator.config import LLM_CACHE_ENABLED
 from orchestrator.core import PersistentOrchestrator
 from orchestrator.types import TaskPacket
 from orchestrator.llm import LLMClient
 
+log = logging.getLogger(__name__)
+
 def main() -> None:
     if len(sys.argv) < 2:
         sys.stderr.write("Usage: python main.py \"<objective>\"\n")
@@ -14,6 +18,9 @@ def main() -> None:
 
     objective = sys.argv[1]
 
+    # Every orchestrator module logs through `logging` as "[DEBUG] ..." stderr lines; LOG_LEVEL filters them
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG").upper(), format="[%(levelname)s] %(message)s", stream=sys.stderr)
+
     # Optional allowlist via env FILES_ALLOWED="a.py,b.py"
     allow = os.environ.get("FILES_ALLOWED", "").strip()
     files_allowed: Tuple[str, ...] = tuple([p.strip() for p in allow.split(",") if p.strip()])
@@ -38,13 +45,13 @@ def main() -> None:
                 task_dirs.append(item_path)
         
         if not task_dirs:
-            print("[DEBUG] No task directories found to resume", file=sys.stderr)
+            log.debug("No task directories found to resume")
             resume = False
         else:
             # Use the most recent task directory
             task_dirs.sort(key=lambda x: os.path.getmtime(x), reverse=True)
             workspace_dir = task_dirs[0]
-            print(f"[DEBUG] Resuming from {workspace_dir}", file=sys.stderr)
+            log.debug("Resuming from %s", workspace_dir)
     else:
         # Create new workspace
         base_dir = os.path.abspath("sample_project")
@@ -66,16 +73,17 @@ def main() -> None:
         task_id=task_id
     )
 
-    llm = LLMClient(log_path=log_file)
-    
-    if resume:
-        # Try to resume existing workflow
-        orchestrator = PersistentOrchestrator(llm, workspace_dir, task_id)
-        code = orchestrator.run()
-    else:
-        # Start new workflow
-        orchestrator = PersistentOrchestrator(llm, workspace_dir, task_id)
-        code = orchestrator.run(packet)
+    # Cache identical LLM calls per workspace so resumed runs don't pay for them twice
+    cache_path = os.path.join(workspace_dir, ".agent_state", "llm_cache.db") if LLM_CACHE_ENABLED else None
+    with LLMClient(log_path=log_file, cache_path=cache_path) as llm:
+        if resume:
+            # Try to resume existing workflow
+            orchestrator = PersistentOrchestrator(llm, workspace_dir, task_id)
+            code = orchestrator.run()
+        else:
+            # Start new workflow
+            orchestrator = PersistentOrchestrator(llm, workspace_dir, task_id)
+            code = orchestrator.run(packet)
     
     raise SystemExit(code)
 
@@ -0,0 +1,29 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes (orjson if installed, stdlib otherwise)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
+
+def dumps_text(obj: Any, indent: bool = False) -> str:
+    """dumps() decoded to str, for embedding JSON in prompts"""
+    return dumps(obj, indent=indent).decode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,10 +1,19 @@
-import json
+import functools
+import logging
+import os
 import re
-import sys
-from typing import Any, Dict, Tuple
-
+import signal
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from ._json import dumps_text
 from .state import StateManager
-from .types import RunContext
+from .types import RunContext, snippet
 from .tools import PersistentTools
 from .llm import LLMClient
 from .config import (
@@ -20,10 +29,103 @@ from .config import (
     MAX_CODER_STEPS,
     MAX_SPEC_REVIEW_STEPS,
     MAX_PATCH_REVIEW_STEPS,
+    MAX_BATCH_COMMANDS,
     MAX_FILES_PER_READ,
+    READ_FILES_SNIPPET_CHARS,
     MAX_TESTER_COMMANDS,
+    AGENT_HISTORY_WINDOW,
+    ARCHITECT_SHORTCUT_MAX_OBJECTIVE,
+    DAEMON_SMOKE_WAIT,
+    PATCH_PROMPT_INLINE_CHARS,
+    DAEMON_SMOKE_POLL,
+    URL_CHECK_TIMEOUT,
+    URL_CHECK_USE_CURL,
+    URL_CHECK_WORKERS,
 )
 
+log = logging.getLogger(__name__)
+
+# Files the Architect reads for context (specs, requirements, configs)
+_CONFIG_RE = re.compile(r"spec|req|README|config|json$|yaml$|yml$", re.IGNORECASE)
+# Source files the Planner samples
+_CODE_SUFFIXES = ('.py', '.js', '.ts', '.java', '.cpp', '.c', '.go', '.rs')
+# Batch commands that only observe the workspace, safe to run side by side
+_READ_ONLY_COMMANDS = frozenset(("read_files", "list_files"))
+_PID_RE = re.compile(r"__PID__=(\d+)")
+# Objectives describing long-running processes get the daemon smoke test
+_DAEMON_RE = re.compile(r"every |runs continuously|daemon|server|loop")
+
+# Like curl --insecure: the check is about reachability, not certificate hygiene
+_INSECURE_SSL = ssl.create_default_context()
+_INSECURE_SSL.check_hostname = False
+_INSECURE_SSL.verify_mode = ssl.CERT_NONE
+
+def _request_status(url: str, method: str) -> Tuple[int, str]:
+    req = urllib.request.Request(url, method=method, headers={"User-Agent": "curl/8"})
+    try:
+        with urllib.request.urlopen(req, timeout=URL_CHECK_TIMEOUT, context=_INSECURE_SSL) as resp:
+            return resp.status, resp.reason
+    except urllib.error.HTTPError as e:
+        return e.code, e.reason
+
+def _http_status(url: str) -> Tuple[int, str]:
+    """Status code and reason of url after redirects: HEAD, retried as GET if the server refuses HEAD"""
+    status, reason = _request_status(url, "HEAD")
+    if status in (403, 405, 501):
+        status, reason = _request_status(url, "GET")
+    return status, reason
+
+def _tail_lines(path: str, n: int = 10, block: int = 8192) -> str:
+    """Last n lines of a file, read in-process from its end ('' if missing)"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - block))
+            data = f.read()
+    except OSError:
+        return ""
+    return b"\n".join(data.splitlines()[-n:]).decode("utf-8", errors="replace")
+
+class StepHistory:
+    """Agent-loop transcript: head parts always sent, the last `window` steps verbatim, older steps summarized"""
+    
+    def __init__(self, head: List[str], window: int = AGENT_HISTORY_WINDOW) -> None:
+        self.head = head
+        self.window = window
+        self.steps: List[Tuple[str, str]] = []  # (one-line summary, full text)
+    
+    def add(self, summary: str, text: str) -> None:
+        self.steps.append((summary, text))
+    
+    def render(self, *tail: str) -> str:
+        parts = list(self.head)
+        older = self.steps[:-self.window] if len(self.steps) > self.window else []
+        if older:
+            parts.append("\n\nPRIOR STEPS (output no longer shown; re-run a command if you need it again):\n")
+            parts.extend(f"- {summary}\n" for summary, _ in older)
+        parts.extend(text for _, text in self.steps[len(older):])
+        parts.extend(tail)
+        return "".join(parts)
+
+def read_previews(ctx: RunContext, tools: PersistentTools, paths: List[str], budget: int = 2000) -> Dict[str, str]:
+    """Head+tail previews of paths, served from ctx.file_previews when another agent already read them"""
+    previews = {p: ctx.file_previews[p] for p in paths if p in ctx.file_previews}
+    missing = [p for p in paths if p not in previews]
+    for path, content in tools.read_text_batch(missing).items():
+        if isinstance(content, str):
+            previews[path] = ctx.file_previews[path] = snippet(content, budget // 2)
+    return {p: previews[p] for p in paths if p in previews}
+
+def _step_summary(response: Dict[str, Any], output: str) -> str:
+    """One line describing a COMMAND response and the start of its output"""
+    if response.get("type") == "COMMAND_BATCH":
+        return "batch: " + ", ".join(str(c.get("command")) for c in response.get("commands", []) if isinstance(c, dict))[:200]
+    target = response.get("files") or response.get("file") or response.get("args") or ""
+    first_line = output.strip().split("\n", 1)[0]
+    return f"{response.get('command')} {dumps_text(target)[:160]} -> {first_line[:120]}"
+
+@functools.lru_cache(maxsize=256)
 def format_files_allowed(allowed: Tuple[str, ...]) -> str:
     if not allowed:
         return "(No restriction. All files in workspace allowed except main.py)"
@@ -49,22 +151,21 @@ class Agent:
                 files = [files]
             
             result = {}
-            for f in files[:MAX_FILES_PER_READ]:
-                try:
-                    result[f] = tools.read_text(f)
-                except Exception as e:
-                    if "Is a directory" in str(e):
-                        listing = tools.list_files()
-                        result[f] = f"Directory listing:\n{json.dumps(listing, indent=2)}"
-                    else:
-                        result[f] = f"ERROR: {e}"
-            return f"Read Files Output:\n{json.dumps(result, indent=2)}"
+            for f, content in tools.read_text_batch(files[:MAX_FILES_PER_READ]).items():
+                if isinstance(content, str):
+                    result[f] = snippet(content, READ_FILES_SNIPPET_CHARS)
+                elif "Is a directory" in str(content):
+                    listing = tools.list_files()
+                    result[f] = f"Directory listing:\n{dumps_text(listing)}"
+                else:
+                    result[f] = f"ERROR: {content}"
+            return f"Read Files Output:\n{dumps_text(result)}"
             
         elif cmd == "list_files":
             listing = tools.list_files()
             if not listing:
                 return "Directory is empty. (No files locally). You should write some code."
-            return f"List Files Output:\n{json.dumps(listing, indent=2)}"
+            return f"List Files Output:\n{dumps_text(listing)}"
             
         elif cmd == "write_file":
             fpath = cmd_data.get("file")
@@ -82,6 +183,24 @@ class Agent:
             
         return f"Unknown command: {cmd}"
 
+    def execute_batch(self, batch: Dict[str, Any], tools: PersistentTools) -> str:
+        """Run a COMMAND_BATCH in order; consecutive read-only commands run concurrently"""
+        commands = [c for c in batch.get("commands", []) if isinstance(c, dict)][:MAX_BATCH_COMMANDS]
+        outputs: List[str] = []
+        i = 0
+        while i < len(commands):
+            j = i + 1
+            if commands[i].get("command") in _READ_ONLY_COMMANDS:
+                while j < len(commands) and commands[j].get("command") in _READ_ONLY_COMMANDS:
+                    j += 1
+            if j - i > 1:
+                with ThreadPoolExecutor(max_workers=j - i) as pool:
+                    outputs.extend(pool.map(lambda c: self.execute_command(c, tools), commands[i:j]))
+            else:
+                outputs.append(self.execute_command(commands[i], tools))
+            i = j
+        return "\n\n".join(f"=== output of {c.get('command')} ===\n{out}" for c, out in zip(commands, outputs))
+    
     def run_with_tools(self, ctx: RunContext, llm: LLMClient, tools: PersistentTools) -> Dict[str, Any]:
         """Override this method to use tools for file operations"""
         raise NotImplementedError
@@ -93,6 +212,7 @@ class Agent:
 
 class ArchitectAgent(Agent):
     name = "architect"
+    shortcuts = 0  # Template specs returned without an LLM call (process-wide)
     
     def get_system_prompt(self) -> str:
         return SYSTEM_ARCHITECT
@@ -100,35 +220,41 @@ class ArchitectAgent(Agent):
     def run_with_tools(self, ctx: RunContext, llm: LLMClient, tools: PersistentTools) -> Dict[str, Any]:
         # First, read any existing relevant files to understand context
         existing_files = tools.list_files()
-        relevant_files = []
         
         # Look for common config/spec files
-        config_patterns = ['.*spec.*', '.*req.*', 'README', 'config.*', '.*json$', '.*yaml$', '.*yml$']
-        for pattern in config_patterns:
-            for file in existing_files:
-                if re.search(pattern, file, re.IGNORECASE):
-                    relevant_files.append(file)
+        relevant_files = [f for f in existing_files if _CONFIG_RE.search(f)]
+        
+        # Trivial objective, nothing to read, nothing restricted: the LLM would only restate the objective
+        objective = ctx.packet.objective
+        if (len(objective) < ARCHITECT_SHORTCUT_MAX_OBJECTIVE and not relevant_files
+                and not ctx.packet.files_allowed):
+            ArchitectAgent.shortcuts += 1
+            log.debug("Architect shortcut: template spec (#%d)", ArchitectAgent.shortcuts)
+            return {
+                "type": "SPECIFICATION",
+                "overview": objective,
+                "requirements": [f"Implement: {objective}"],
+                "verification_plan": ["Basic smoke test"],
+            }
         
         # Read up to 5 relevant files
         file_contents = {}
-        for file in relevant_files[:5]:
-            try:
-                content = tools.read_text(file)
-                file_contents[file] = content[:1000] + ("..." if len(content) > 1000 else "")
-            except:
-                pass
+        for file, content in tools.read_text_batch(relevant_files[:5]).items():
+            if isinstance(content, str):
+                file_contents[file] = snippet(content, 500)
         
-        user = (
+        # Stable prefix first, workspace-dependent content last (keeps provider prompt caches warm)
+        prefix = (
             f"Objective: {ctx.packet.objective}\n\n"
             f"Files Allowed: {format_files_allowed(ctx.packet.files_allowed)}\n\n"
+            "Return SPECIFICATION JSON only.\n\n"
         )
         
+        user = ""
         if file_contents:
-            user += f"Existing relevant files:\n{json.dumps(file_contents, indent=2)}\n\n"
-        
-        user += "Return SPECIFICATION JSON only."
+            user += f"Existing relevant files:\n{dumps_text(file_contents)}\n\n"
         
-        return llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE)
+        return llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE, prefix=prefix)
 
 
 class PlannerAgent(Agent):
@@ -139,31 +265,22 @@ class PlannerAgent(Agent):
     
     def run_with_tools(self, ctx: RunContext, llm: LLMClient, tools: PersistentTools) -> Dict[str, Any]:
         # Read current code structure to plan better
-        code_files = []
-        for file in tools.list_files():
-            if file.endswith(('.py', '.js', '.ts', '.java', '.cpp', '.c', '.go', '.rs')):
-                code_files.append(file)
+        code_files = tools.files_with_suffix(_CODE_SUFFIXES)
         
-        # Sample a few files to understand structure
-        sampled_contents = {}
-        for file in code_files[:3]:  # Read up to 3 code files
-            try:
-                content = tools.read_text(file, max_bytes=2000)
-                sampled_contents[file] = content
-            except:
-                pass
+        # Sample a few files to understand structure (up to 3 code files)
+        sampled_contents = read_previews(ctx, tools, code_files[:3])
         
-        user = (
+        prefix = (
             f"Objective: {ctx.packet.objective}\n\n"
-            f"FROZEN SPEC: {json.dumps(ctx.frozen_spec, ensure_ascii=False)}\n\n"
+            f"FROZEN SPEC: {ctx.spec_json()}\n\n"
+            "Return PLAN JSON only.\n\n"
         )
         
+        user = ""
         if sampled_contents:
-            user += f"Current codebase (sample):\n{json.dumps(sampled_contents, indent=2)}\n\n"
+            user += f"Current codebase (sample):\n{dumps_text(sampled_contents)}\n\n"
         
-        user += "Return PLAN JSON only."
-        
-        return llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE)
+        return llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE, prefix=prefix)
 
 
 class CoderAgent(Agent):
@@ -174,25 +291,29 @@ class CoderAgent(Agent):
     
     def run_with_tools(self, ctx: RunContext, llm: LLMClient, tools: PersistentTools) -> Dict[str, Any]:
         # First, let the coder examine the current state
-        files = tools.list_files()
+        files = tools.list_files_text()
         
         # The coder can decide what files to read based on the objective
         # We'll provide a summary and let the LLM request specific files if needed
         
-        user = (
+        prefix = (
             f"Objective: {ctx.packet.objective}\n\n"
-            f"FROZEN SPEC: {json.dumps(ctx.frozen_spec, ensure_ascii=False)}\n\n"
-            f"Files Allowed: {format_files_allowed(ctx.packet.files_allowed)}\n"
-            f"Workspace files: {files}\n\n"
+            f"FROZEN SPEC: {ctx.spec_json()}\n\n"
+            f"Files Allowed: {format_files_allowed(ctx.packet.files_allowed)}\n\n"
             "You can first examine files by requesting to read them.\n"
             "Output format:\n"
             "- To read files: {type:'COMMAND', command:'read_files', files:['path1', 'path2']}\n"
             "- To list files: {type:'COMMAND', command:'list_files'}\n"
             "- To write file: {type:'COMMAND', command:'write_file', file:'path', content:'...'}\n"
             "- To run command: {type:'COMMAND', command:'run_shell', args:'ls -la'}\n"
+            "- To run several at once: {type:'COMMAND_BATCH', commands:[{command:'read_files', files:['a.py']}, {command:'list_files'}]}\n"
             "- To FINISH: {type:'PATCH', files:[{path:'...', action:'write', content:'...'}]}\n\n"
-            "What would you like to do first?"
         )
+        # Transcript pieces, joined once per LLM call
+        history = StepHistory([
+            f"Workspace files:\n{files}\n\n"
+            "What would you like to do first?"
+        ])
         
         # Allow up to 15 interaction steps to write/verify code
         max_steps = MAX_CODER_STEPS
@@ -200,10 +321,10 @@ class CoderAgent(Agent):
         last_output = None
         
         while step_count < max_steps:
-            response = llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE)
+            response = llm.chat_json(self.get_system_prompt(), history.render(), temperature=DEFAULT_TEMPERATURE, prefix=prefix)
             
-            if response.get("type") == "COMMAND":
-                output = self.execute_command(response, tools)
+            if response.get("type") in ("COMMAND", "COMMAND_BATCH"):
+                output = self.execute_batch(response, tools) if response["type"] == "COMMAND_BATCH" else self.execute_command(response, tools)
                 
                 # Loop detection: If output is identical to last time, warn the agent harder or force a break
                 if output == last_output:
@@ -217,8 +338,7 @@ class CoderAgent(Agent):
                      output += warning_msg
                 last_output = output
 
-                user += f"\n\n{output}\n"
-                user += "Continue implementing/verifying or output PATCH:"
+                history.add(_step_summary(response, output), f"\n\n{output}\nContinue implementing/verifying or output PATCH:")
                 step_count += 1
                 continue
             
@@ -227,13 +347,14 @@ class CoderAgent(Agent):
             
             else:
                 # Unexpected response, try to continue
-                user += f"\n\nPlease use either COMMAND or PATCH.\nReceived: {json.dumps(response, indent=2)}"
+                history.add(f"invalid response type {response.get('type')!r}",
+                            f"\n\nPlease use either COMMAND or PATCH.\nReceived: {dumps_text(response, indent=True)}")
                 step_count += 1
                 continue
         
         # If we've executed enough steps, force a PATCH
-        user += "\n\nYou've executed enough steps. Please output a PATCH now."
-        final_response = llm.chat_json(self.get_system_prompt(), user, temperature=DEFAULT_TEMPERATURE)
+        final_response = llm.chat_json(self.get_system_prompt(), history.render("\n\nYou've executed enough steps. Please output a PATCH now."),
+                                       temperature=DEFAULT_TEMPERATURE, prefix=prefix)
         
         if final_response.get("type") != "PATCH":
             # Fallback
@@ -258,18 +379,14 @@ class TesterAgent(Agent):
     def run_with_tools(self, ctx: RunContext, llm: LLMClient, tools: PersistentTools) -> Dict[str, Any]:
         # Same tester logic as before, but with enhanced tools
         objective_lower = ctx.packet.objective.lower()
-        looks_daemon = any(k in objective_lower for k in ["every ", "every 60", "runs continuously", "daemon", "server", "loop"])
+        looks_daemon = _DAEMON_RE.search(objective_lower) is not None
 
         if looks_daemon:
-            print("[DEBUG] Daemon task detected. Running deterministic smoke test.", file=sys.stderr)
+            log.debug("Daemon task detected. Running deterministic smoke test.")
             
-            # Identify script name from patches
-            script_name = "btc_price_tracker.py"
-            for p in reversed(ctx.patches):
-                for f in p.get("files", []):
-                    if f["path"].endswith(".py") and f["path"] != "main.py":
-                        script_name = f["path"]
-                        break
+            # Identify script name from the newest patch that has one
+            script_name = next((f["path"] for p in reversed(ctx.patches) for f in p.get("files", [])
+                                if f["path"].endswith(".py") and f["path"] != "main.py"), "btc_price_tracker.py")
             
             # Check if file exists before running
             if not tools.file_exists(script_name):
@@ -278,49 +395,42 @@ class TesterAgent(Agent):
             # Read the script first to understand it
             try:
                 script_content = tools.read_text(script_name, max_bytes=5000)
-                print(f"[DEBUG] Script preview:\n{script_content[:500]}...", file=sys.stderr)
+                log.debug("Script preview:\n%s...", script_content[:500])
             except:
                 pass
             
             out = tools.run_shell(f"python3 -u {script_name} > agent_test.log 2>&1 &")
-            pid_match = re.search(r"__PID__=(\d+)", out)
+            pid_match = _PID_RE.search(out)
             pid = pid_match.group(1) if pid_match else None
 
-            tools.run_shell("sleep 5")
+            from .gates import scan_db_rows  # Deferred like core's: only daemon smoke tests probe databases
             
-            # Check DB exists and has at least 1 row
-            check = tools.run_shell(
-                "python3 - <<'PY'\n"
-                "import os, sqlite3, glob\n"
-                "dbs = glob.glob('*.db')\n"
-                "print(f'FOUND_DBS={dbs}')\n"
-                "best_rows = 0\n"
-                "for db in dbs:\n"
-                "    try:\n"
-                "        c = sqlite3.connect(db).cursor()\n"
-                "        tables = c.execute(\"SELECT name FROM sqlite_master WHERE type='table';\").fetchall()\n"
-                "        for t in tables:\n"
-                "            name = t[0]\n"
-                "            c.execute(f'SELECT count(*) FROM {name}')\n"
-                "            rows = c.fetchone()[0]\n"
-                "            print(f'DB={db} TABLE={name} ROWS={rows}')\n"
-                "            if rows > best_rows: best_rows = rows\n"
-                "    except Exception as e:\n"
-                "        print(f'ERROR reading {db}: {e}')\n"
-                "print(f'MAX_ROWS={best_rows}')\n"
-                "PY"
-            )
+            # Poll for the first DB row instead of a fixed sleep
+            deadline = time.monotonic() + DAEMON_SMOKE_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(DAEMON_SMOKE_POLL)
+                if any(rows for _, _, rows in scan_db_rows(tools.workspace_dir, stop_at=1)[1]):
+                    break
+            
+            # Check DB exists and has at least 1 row (in-process, no interpreter spawn)
+            dbs, counts, errors = scan_db_rows(tools.workspace_dir)
+            best_rows = max((rows for _, _, rows in counts), default=0)
+            check = "\n".join([f"FOUND_DBS={dbs}"]
+                              + [f"DB={db} TABLE={name} ROWS={rows}" for db, name, rows in counts]
+                              + [f"ERROR reading {db}: {e}" for db, e in errors.items()]
+                              + [f"MAX_ROWS={best_rows}"])
 
-            log_tail = tools.run_shell("tail -n 10 agent_test.log")
+            log_tail = _tail_lines(os.path.join(tools.workspace_dir, "agent_test.log"))
 
             if pid:
-                tools.run_shell(f"kill {pid} || true")
+                # In-process: 'kill' is not an allowed shell command, so the old call never ran
+                try:
+                    os.kill(int(pid), signal.SIGTERM)
+                except OSError:
+                    pass
 
-            row_match = re.search(r"MAX_ROWS=\s*(\d+)", check)
-            db_ok = row_match and int(row_match.group(1)) > 0
-            
-            if db_ok:
-                return {"type": "TEST_REPORT", "success": True, "report": f"Daemon started, wrote to DB (verified {row_match.group(1)} rows). Log tail: {log_tail}"}
+            if best_rows > 0:
+                return {"type": "TEST_REPORT", "success": True, "report": f"Daemon started, wrote to DB (verified {best_rows} rows). Log tail: {log_tail}"}
             else:
                 if "Traceback" in log_tail or "Error" in log_tail:
                     return {"type": "TEST_REPORT", "success": False, "report": f"Daemon test failed. Log indicates error:\n{log_tail}"}
@@ -331,39 +441,30 @@ class TesterAgent(Agent):
         max_commands = MAX_TESTER_COMMANDS
         
         # First, read the main implementation files
-        implementation_files = []
-        for p in ctx.patches:
-            for f in p.get("files", []):
-                if f["path"].endswith(('.py', '.js', '.sh')) and f["path"] not in implementation_files:
-                    implementation_files.append(f["path"])
+        implementation_files = list(dict.fromkeys(f["path"] for p in ctx.patches for f in p.get("files", [])
+                                                  if f["path"].endswith(('.py', '.js', '.sh'))))
         
         # Read up to 2 implementation files
-        file_previews = {}
-        for file in implementation_files[:2]:
-            try:
-                content = tools.read_text(file, max_bytes=2000)
-                file_previews[file] = content
-            except:
-                pass
+        file_previews = read_previews(ctx, tools, implementation_files[:2])
         
-        history = (
+        prefix = (
             f"Objective: {ctx.packet.objective}\n\n"
-            f"FROZEN SPEC: {json.dumps(ctx.frozen_spec, ensure_ascii=False)}\n\n"
-            f"PATCH: {json.dumps(ctx.patches[-1], ensure_ascii=False)}\n\n"
+            f"FROZEN SPEC: {ctx.spec_json()}\n\n"
         )
+        history = [f"PATCH: {ctx.last_patch_summary_json(PATCH_PROMPT_INLINE_CHARS)}\n\n"]
         
         if file_previews:
-            history += f"Implementation files (preview):\n{json.dumps(file_previews, indent=2)}\n\n"
+            history.append(f"Implementation files (preview):\n{dumps_text(file_previews)}\n\n")
         
         for i in range(max_commands + 2):
-            print(f"[DEBUG] Tester loop {i+1}", file=sys.stderr)
+            log.debug("Tester loop %d", i + 1)
             
             force_report = (i >= max_commands)
-            prompt = history
+            prompt = "".join(history)
             if force_report:
                 prompt += "\n\nSTOP: You have reached the command limit. You MUST output a TEST_REPORT now."
 
-            resp = llm.chat_json(SYSTEM_TESTER, prompt, temperature=0.1)
+            resp = llm.chat_json(SYSTEM_TESTER, prompt, temperature=0.1, prefix=prefix)
             
             if resp.get("type") == "TEST_REPORT":
                 return resp
@@ -379,7 +480,7 @@ class TesterAgent(Agent):
                 cmd = resp.get("command", "")
                 out = tools.run_shell(cmd)
                 
-                history += f"\n>>> COMMAND: {cmd}\n<<< OUTPUT:\n{out}\n\n"
+                history.append(f"\n>>> COMMAND: {cmd}\n<<< OUTPUT:\n{out}\n\n")
                 continue
             
             return resp
@@ -400,13 +501,24 @@ class ResearchAgent(Agent):
         raise NotImplementedError("Researcher is called via helper, not main loop")
     
     def verify_url(self, url: str, tools: PersistentTools) -> str:
-        print(f"[DEBUG] Validating URL: {url}", file=sys.stderr)
+        log.debug("Validating URL: %s", url)
         
         # Security check: basic URL validation
         if not url.startswith("http"):
             return f"Invalid URL format: {url}"
             
-        cmd = f"curl -I -L --max-time 10 --insecure '{url}'"
+        if not URL_CHECK_USE_CURL:
+            try:
+                status, reason = _http_status(url)
+            except Exception as e:
+                return f"URL {url} verification result:\nERROR: {e}"[:600]
+            if status == 200:
+                return f"URL {url} is VALID (200 OK)."
+            if status == 404:
+                return f"URL {url} is BROKEN (404 Not Found)."
+            return f"URL {url} verification result:\nHTTP {status} {reason}"
+        
+        cmd = f"curl -I -L --max-time {URL_CHECK_TIMEOUT} --insecure '{url}'"
         out = tools.run_shell(cmd)
         
         if "HTTP/2 200" in out or "HTTP/1.1 200" in out:
@@ -415,13 +527,37 @@ class ResearchAgent(Agent):
              return f"URL {url} is BROKEN (404 Not Found)."
         else:
              return f"URL {url} verification result:\n{out[:500]}"
+    
+    def verify_urls(self, urls: List[str], tools: PersistentTools, cache: Optional[Dict[str, str]] = None) -> List[str]:
+        """verify_url for each distinct URL missing from cache (keyed without trailing '/'), run concurrently; input order kept"""
+        cache = {} if cache is None else cache
+        keys = list(dict.fromkeys(url.rstrip("/") for url in urls))
+        missing = {}
+        for url in urls:
+            if url.rstrip("/") not in cache:
+                missing.setdefault(url.rstrip("/"), url)
+        if len(missing) <= 1:
+            reports = [self.verify_url(url, tools) for url in missing.values()]
+        else:
+            with ThreadPoolExecutor(max_workers=min(URL_CHECK_WORKERS, len(missing))) as pool:
+                reports = list(pool.map(lambda url: self.verify_url(url, tools), missing.values()))
+        cache.update(zip(missing, reports))
+        return [cache[key] for key in keys]
 
 
 class CriticAgent(Agent):
     name = "critic"
     
-    def __init__(self, stage: str) -> None:
+    def __init__(self, stage: str, exclusive: Optional[threading.Lock] = None) -> None:
         self.stage = stage  # 'SPEC' or 'PATCH'
+        # Held around commands that run or write in the workspace (when reviewing alongside TEST's gates)
+        self.exclusive = exclusive
+    
+    def execute_command(self, cmd_data: Dict[str, Any], tools: PersistentTools) -> str:
+        if self.exclusive is None or cmd_data.get("command") in _READ_ONLY_COMMANDS:
+            return super().execute_command(cmd_data, tools)
+        with self.exclusive:
+            return super().execute_command(cmd_data, tools)
     
     def get_system_prompt(self) -> str:
         if self.stage == "SPEC":
@@ -442,36 +578,37 @@ class CriticAgent(Agent):
 
         if self.stage == "SPEC":
             # For SPEC, allow interaction to check URLs
-            artifact = ctx.frozen_spec
-            
             # Use separate field for research report
             research_report = ctx.latest_research_report
             
-            user = f"Objective: {ctx.packet.objective}\n\n"
-            if research_report:
-                user += f"*** RESEARCH REPORT (AUTO-VERIFIED URLs) ***\n{research_report}\n\n"
-            
-            user += f"Artifact: {json.dumps(artifact, ensure_ascii=False)}\n\n"
-            user += "You can verify URLs using {type:'COMMAND', command:'verify_url', args:'<url>'}\n"
-            user += "Return REVIEW JSON only or COMMAND."
+            prefix = (
+                f"Objective: {ctx.packet.objective}\n\n"
+                f"Artifact: {ctx.spec_json()}\n\n"
+                "You can verify URLs using {type:'COMMAND', command:'verify_urls', args:['<url>', ...]}\n"
+                "Return REVIEW JSON only or COMMAND.\n\n"
+            )
+            history = StepHistory([f"*** RESEARCH REPORT (AUTO-VERIFIED URLs) ***\n{research_report}\n\n"] if research_report else [])
 
             # Interaction loop for SPEC
             max_steps = MAX_SPEC_REVIEW_STEPS
             step_count = 0
             
             while step_count < max_steps:
-                response = llm.chat_json(self.get_system_prompt(), user, temperature=0.1)
+                response = llm.chat_json(self.get_system_prompt(), history.render(), temperature=0.1, prefix=prefix)
 
                 if response.get("type") == "COMMAND":
-                    if response.get("command") == "verify_url":
-                        # Special handling for verify_url in Critic
-                        url = response.get("args", "")
-                        researcher = ResearchAgent()
-                        report = researcher.verify_url(url, tools)
-                        user += f"\n\nVerifier Report ({url}):\n{report}\n\nNext?"
+                    if response.get("command") in ("verify_url", "verify_urls"):
+                        # Special handling for URL checks in Critic: every URL of the turn in one batch
+                        urls = response.get("args", "")
+                        if not isinstance(urls, list):
+                            urls = [urls]
+                        urls = [u for u in urls if isinstance(u, str)]
+                        reports = "\n".join(ResearchAgent().verify_urls(urls, tools, ctx.url_reports))
+                        history.add(_step_summary(response, reports),
+                                    f"\n\nVerifier Report ({', '.join(urls)}):\n{reports}\n\nNext?")
                     else:
                         output = self.execute_command(response, tools)
-                        user += f"\n\n{output}\n\nNext?"
+                        history.add(_step_summary(response, output), f"\n\n{output}\n\nNext?")
                     
                     step_count += 1
                     continue
@@ -480,7 +617,7 @@ class CriticAgent(Agent):
                     return response
                 
                 else:
-                     user += f"\n\nUnknown response: {json.dumps(response)}"
+                     history.add(f"unknown response type {response.get('type')!r}", f"\n\nUnknown response: {dumps_text(response)}")
                      step_count += 1
                      continue
             
@@ -493,26 +630,23 @@ class CriticAgent(Agent):
             }
 
         # For PATCH, we do the interactive verification
-        artifact = ctx.patches[-1]
-        frozen = ctx.frozen_spec
-
-        user = f"Objective: {ctx.packet.objective}\n\n"
-        if frozen is not None:
-            user += f"FROZEN SPEC: {json.dumps(frozen, ensure_ascii=False)}\n\n"
-        user += f"Artifact: {json.dumps(artifact, ensure_ascii=False)}\n\n"
+        prefix = f"Objective: {ctx.packet.objective}\n\n"
+        if ctx.frozen_spec is not None:
+            prefix += f"FROZEN SPEC: {ctx.spec_json()}\n\n"
+        prefix += "You can request to read files or run commands to verify. Output COMMAND or REVIEW.\n\n"
         
-        user += "You can request to read files or run commands to verify. Output COMMAND or REVIEW."
+        history = StepHistory([f"Artifact: {ctx.last_patch_summary_json(PATCH_PROMPT_INLINE_CHARS)}\n\n"])
 
         # Interaction loop
         max_steps = MAX_PATCH_REVIEW_STEPS
         step_count = 0
         
         while step_count < max_steps:
-            response = llm.chat_json(self.get_system_prompt(), user, temperature=0.1)
+            response = llm.chat_json(self.get_system_prompt(), history.render(), temperature=0.1, prefix=prefix)
 
-            if response.get("type") == "COMMAND":
-                output = self.execute_command(response, tools)
-                user += f"\n\n{output}\n\nNext?"
+            if response.get("type") in ("COMMAND", "COMMAND_BATCH"):
+                output = self.execute_batch(response, tools) if response["type"] == "COMMAND_BATCH" else self.execute_command(response, tools)
+                history.add(_step_summary(response, output), f"\n\n{output}\n\nNext?")
                 step_count += 1
                 continue
 
@@ -520,7 +654,7 @@ class CriticAgent(Agent):
                 return response
             
             else:
-                 user += f"\n\nUnknown response: {json.dumps(response)}"
+                 history.add(f"unknown response type {response.get('type')!r}", f"\n\nUnknown response: {dumps_text(response)}")
                  step_count += 1
                  continue
         
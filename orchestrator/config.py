@@ -1,7 +1,10 @@
 import os
 
-ALLOWED_TYPES = {"SPECIFICATION", "PLAN", "PATCH", "TEST_REPORT", "REVIEW", "QUESTION", "COMMAND"}
+ALLOWED_TYPES = {"SPECIFICATION", "PLAN", "PATCH", "TEST_REPORT", "REVIEW", "QUESTION", "COMMAND", "COMMAND_BATCH"}
 
+# "prompt_cache_blocks": True sends system/prefix as content blocks tagged with
+# cache_control (Anthropic-style). Without it the prefix is still sent first, which
+# is what automatic prefix caches (DeepSeek, OpenAI) key on.
 LLM_CONFIGS = {
     "deepseek": {
         "api_url": "https://api.deepseek.com/chat/completions",
@@ -28,32 +31,66 @@ BLACKLIST_PATTERNS = [r"rm\s+-rf\s+/", r"sudo", r">\s+/dev/sd", r"mkfs", r"dd\s+
 
 # LLM Settings
 LLM_RETRIES = 3
+LLM_RETRY_MAX_DELAY = 30  # Cap (seconds) on the backoff between failed requests, Retry-After included
 LLM_TIMEOUT = 300
 DEFAULT_TEMPERATURE = 0.2
+LLM_STREAM = True  # Stream responses and return as soon as a complete, valid JSON object arrives
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # Seconds a cached response stays valid; 0 = forever
+LLM_CACHE_MAX_TEMPERATURE = 0.2  # Calls sampled hotter than this are never served from the cache
 
 # Tool Settings
 MAX_FILE_READ_BYTES = 50_000
 MAX_FILE_LIST_LIMIT = 300
+MAX_PROMPT_FILE_LIST = 200  # Paths pasted into prompts; the rest are summarized as "... N more"
+MMAP_SEARCH_THRESHOLD = 64 * 1024  # search_in_files memory-maps files larger than this
+MAX_SEARCH_RESULTS = 200
+MAX_SEARCH_RESULTS_PER_FILE = 20
+URL_CHECK_WORKERS = 8  # URLs verified concurrently by the researcher
+URL_CHECK_TIMEOUT = 10
+URL_CHECK_USE_CURL = os.environ.get("ORCH_USE_CURL", "").lower() in ("1", "true", "yes")  # Old curl-subprocess check
+READ_CACHE_MAX_FILES = 256  # unchanged files are served from memory across agents
 SHELL_TIMEOUT = 30
 SHELL_BACKGROUND_TIMEOUT = 5
+# Run shell-syntax commands in one long-lived bash per workspace instead of a fresh /bin/sh each
+USE_PERSISTENT_SHELL = os.environ.get("USE_PERSISTENT_SHELL", "").lower() in ("1", "true", "yes")
 
 # Agent Settings
 MAX_CODER_STEPS = 15
 MAX_SPEC_REVIEW_STEPS = 5
 MAX_PATCH_REVIEW_STEPS = 10
 MAX_FILES_PER_READ = 5
+MAX_BATCH_COMMANDS = 8  # Commands run from one COMMAND_BATCH; the rest are dropped
+READ_FILES_SNIPPET_CHARS = 8192  # read_files returns head + tail of this size for longer files
 MAX_TESTER_COMMANDS = 3
+# Objectives shorter than this, in an empty unrestricted workspace, get a template spec with no LLM call (0 = off)
+ARCHITECT_SHORTCUT_MAX_OBJECTIVE = int(os.environ.get("ARCHITECT_SHORTCUT", "0"))
+AGENT_HISTORY_WINDOW = 6  # Latest command steps resent verbatim in agent loops; older ones become one-line summaries
+DAEMON_SMOKE_WAIT = 5.0  # seconds to wait for a daemon's first DB row
+DAEMON_SMOKE_POLL = 0.2
+PATCH_PROMPT_INLINE_CHARS = 2048  # Critic/Tester see longer patch bodies cut to this; they can read the file
+PATCH_BLOB_MIN_CHARS = 2048  # Saved context keeps longer patch bodies in the blob store by reference
 
 # Workflow Settings
 MAX_REPAIRS = 3
 MAX_SPEC_REPAIRS = 2
+CONTEXT_HISTORY = MAX_REPAIRS + 2  # Patches / test reports kept on RunContext; older ones remain as artifacts
+GATE_EVIDENCE_CHARS = 1000  # Head and tail of each failing gate's evidence sent to repair_code_from_test
+# Start the Planner while the Critic reviews the spec; kept only on APPROVE (a rejected spec wastes one Planner call)
+SPECULATIVE_PLAN = os.environ.get("SPECULATIVE_PLAN", "true").lower() in ("1", "true", "yes")
+# must_run commands run concurrently by TEST; 1 keeps spec order (commands may depend on earlier ones)
+GATE_WORKERS = max(1, int(os.environ.get("GATE_WORKERS", "1")))
+ADVISOR_CRITIC = os.environ.get("ADVISOR_CRITIC", "true").lower() in ("1", "true", "yes")  # Run the advisory patch review at all
+
+# State Settings
+MAX_STATE_BACKUPS = 5  # Versions kept per artifact name in .agent_state/state.db
 
 SYSTEM_BASE = (
     "You are an agent in a software factory.\n"
     "HARD CONSTRAINTS:\n"
     "1) Output EXCLUSIVELY valid JSON. Do not return loose text or custom tags like @@@REVIEW_START@@@.\n"
-    "2) Only when type=COMMAND wrap the JSON in @@@COMMAND_START@@@ and @@@COMMAND_END@@@ delimiters.\n"
-    "3) Allowed top-level output types: SPECIFICATION, PLAN, PATCH, TEST_REPORT, REVIEW, QUESTION, COMMAND\n"
+    "2) Only when type=COMMAND (or COMMAND_BATCH) wrap the JSON in @@@COMMAND_START@@@ and @@@COMMAND_END@@@ delimiters.\n"
+    "3) Allowed top-level output types: SPECIFICATION, PLAN, PATCH, TEST_REPORT, REVIEW, QUESTION, COMMAND, COMMAND_BATCH\n"
     "4) Do not invent requirements. Use only: objective + frozen spec (if provided).\n"
     "5) Be brief.\n"
 )
@@ -70,6 +107,7 @@ SYSTEM_CRITIC_SPEC = SYSTEM_BASE + (
     "ROLE: CRITIC (SPEC REVIEW)\n"
     "Validate the SPECIFICATION against the objective.\n"
     "To verify a URL, you MUST use the verifier tool: {\"type\":\"COMMAND\", \"command\":\"verify_url\", \"args\":\"<url>\"}\n"
+    "To verify several URLs at once (preferred): {\"type\":\"COMMAND\", \"command\":\"verify_urls\", \"args\":[\"<url1>\", \"<url2>\"]}\n"
     "CRITICAL RULE: Only REJECT if there is a BLOCKING functional error.\n"
     "*** TRUST THE RESEARCH REPORT ***. If a URL is marked VALID in the report, DO NOT REJECT IT.\n"
     "If claiming a URL is dead (and not in the report), you MUST verify it first using the verifier tool.\n"
@@ -91,6 +129,7 @@ SYSTEM_CRITIC_PATCH = SYSTEM_BASE + (
     "- To read files: {\"type\":\"COMMAND\", \"command\":\"read_files\", \"files\":[\"path1\"]}\n"
     "- To list files: {\"type\":\"COMMAND\", \"command\":\"list_files\"}\n"
     "- To run command: {\"type\":\"COMMAND\", \"command\":\"run_shell\", \"args\":\"...\"}\n"
+    "- To run several commands in one turn: {\"type\":\"COMMAND_BATCH\", \"commands\":[{\"command\":\"read_files\", \"files\":[\"a.py\"]}, {\"command\":\"run_shell\", \"args\":\"python3 a.py\"}]}\n"
     "- To Finish: {\"type\":\"REVIEW\", \"status\":\"APPROVE\"|\"REJECT\", \"critique\":\"...\", \"failure_tags\":[...]}\n"
 )
 
@@ -107,6 +146,7 @@ SYSTEM_CODER_ENHANCED = SYSTEM_BASE + (
     "You should:\n"
     "1) Read files to understand context.\n"
     "2) Write files and Run commands to implement and verify the solution.\n"
+    "   Independent commands can go in one turn: {\"type\":\"COMMAND_BATCH\", \"commands\":[{\"command\":\"read_files\", \"files\":[\"a.py\"]}, {\"command\":\"list_files\"}]}\n"
     "3) You can use curl/wget to check external resources.\n"
     "4) When satisfied, Output a PATCH JSON: {\"type\":\"PATCH\", \"files\":[{\"path\":\"...\", \"action\":\"write\", \"content\":\"...\"}]}\n"
     "Only edit/create files listed in Files Allowed (if provided).\n"
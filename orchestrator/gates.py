@@ -1,12 +1,62 @@
 import os
 import glob
-import json
+import hashlib
 import sqlite3
 import sys
-from typing import List, Dict, Any, Optional
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
+from .config import GATE_WORKERS
 from .tools import PersistentTools
 
+# Gate results shared by every GateRunner (one is built per APPLY/TEST), bounded like tools' read cache
+_GATE_CACHE_MAX = 256
+# (path, source digest) -> compile error text, or None if it compiled
+_SYNTAX_CACHE: Dict[Tuple[str, bytes], Optional[str]] = {}
+# (workspace, command spec, workspace fingerprint) -> result, for specs marked "cacheable"
+_COMMAND_CACHE: Dict[Tuple[Any, ...], "GateResult"] = {}
+# Files changed this recently may not show a new mtime yet; no fingerprint is taken then
+_FINGERPRINT_MIN_AGE_NS = 1_000_000_000
+
+def _remember(cache: Dict[Any, Any], key: Any, value: Any) -> None:
+    if len(cache) >= _GATE_CACHE_MAX:
+        cache.pop(next(iter(cache)), None)
+    cache[key] = value
+
+def scan_db_rows(workspace_dir: str, stop_at: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, str, int]], Dict[str, str]]:
+    """Row counts of the tables in the workspace's top-level *.db files: (db names, [(db, table, rows)], {db: error}).
+    With stop_at, counts are capped there and the scan ends at the first table that reaches it."""
+    dbs = sorted(os.path.basename(p) for p in glob.glob(os.path.join(glob.escape(workspace_dir), "*.db")))
+    counts: List[Tuple[str, str, int]] = []
+    errors: Dict[str, str] = {}
+    for db in dbs:
+        try:
+            # Read-write but query_only, like the old sqlite3.connect(db): closing the last connection
+            # checkpoints a WAL database and removes its -wal/-shm files, which mode=ro cannot do.
+            # mode=rw (not rwc) so a file deleted since the glob isn't recreated.
+            # Short busy timeout: a daemon may be mid-write, and callers poll again anyway.
+            con = sqlite3.connect(f"file:{urllib.parse.quote(os.path.join(workspace_dir, db))}?mode=rw", uri=True, timeout=1)
+            try:
+                con.execute("PRAGMA query_only = 1")
+                for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+                    quoted = name.replace('"', '""')
+                    if stop_at is None:
+                        rows = con.execute(f'SELECT count(*) FROM "{quoted}"').fetchone()[0]
+                    else:
+                        # Only whether stop_at rows exist matters: LIMIT ends the scan there
+                        rows = con.execute(f'SELECT count(*) FROM (SELECT 1 FROM "{quoted}" LIMIT ?)', (stop_at,)).fetchone()[0]
+                    counts.append((db, name, rows))
+                    if stop_at is not None and rows >= stop_at:
+                        return dbs, counts, errors
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            errors[db] = str(e)
+    return dbs, counts, errors
+
 class GateResult:
     def __init__(self, passed: bool, reason: str, evidence: Dict[str, Any]):
         self.passed = passed
@@ -25,10 +75,8 @@ class GateRunner:
         self.tools = tools
 
     def check_files_exist(self, paths: List[str]) -> GateResult:
-        missing = []
-        for p in paths:
-            if not self.tools.file_exists(p):
-                missing.append(p)
+        exists = self.tools.files_exist(paths)
+        missing = [p for p in paths if not exists[p]]
         
         if missing:
             return GateResult(False, f"Missing required files: {missing}", {"missing": missing})
@@ -39,18 +87,69 @@ class GateRunner:
         for f in files:
             if not f.endswith(".py"):
                 continue
-            res = self.tools.run_shell_structured(f"python3 -m py_compile {f}")
-            if res["exit_code"] != 0:
+            # In-process compile(): what py_compile checks, without a subprocess per file or .pyc output
+            try:
+                with open(os.path.join(self.tools.workspace_dir, f), "rb") as fh:
+                    src = fh.read()
+            except OSError as e:
+                failed.append({"file": f, "stderr": "".join(traceback.format_exception_only(type(e), e))})
+                continue
+            # Unchanged sources (e.g. APPLY re-run after a review) aren't compiled again
+            key = (f, hashlib.blake2b(src, digest_size=16).digest())
+            if key in _SYNTAX_CACHE:
+                error = _SYNTAX_CACHE[key]
+            else:
+                try:
+                    compile(src, f, "exec", dont_inherit=True)
+                    error = None
+                    _remember(_SYNTAX_CACHE, key, error)
+                except (SyntaxError, ValueError) as e:
+                    error = "".join(traceback.format_exception_only(type(e), e))
+                    _remember(_SYNTAX_CACHE, key, error)
+                except (RecursionError, MemoryError) as e:
+                    # Too deeply nested for the compiler: fails the gate like py_compile would (not cached)
+                    error = "".join(traceback.format_exception_only(type(e), e))
+            if error is not None:
                 failed.append({
                     "file": f,
-                    "stderr": res["stderr"]
+                    "stderr": error
                 })
         
         if failed:
             return GateResult(False, "Python syntax errors detected", {"failures": failed})
         return GateResult(True, "Python syntax check passed", {"checked": files})
 
+    def _fingerprint(self) -> Optional[Tuple[Tuple[str, int, int], ...]]:
+        """(path, mtime_ns, size) of every workspace file, or None if one changed too recently to tell"""
+        now = time.time_ns()
+        out = []
+        for rel in self.tools.list_files(limit=sys.maxsize):
+            try:
+                st = os.stat(os.path.join(self.tools.workspace_dir, rel))
+            except OSError:
+                continue
+            if now - st.st_mtime_ns < _FINGERPRINT_MIN_AGE_NS:
+                return None
+            out.append((rel, st.st_mtime_ns, st.st_size))
+        return tuple(out)
+
     def check_command(self, cmd_spec: Dict[str, Any]) -> GateResult:
+        # Commands can have side effects, so only specs marked "cacheable" reuse a result,
+        # and only while no workspace file has changed since
+        key = None
+        if cmd_spec.get("cacheable"):
+            fingerprint = self._fingerprint()
+            if fingerprint is not None:
+                key = (self.tools.workspace_dir, cmd_spec.get("cmd"), cmd_spec.get("exit_code", 0), cmd_spec.get("substr"), fingerprint)
+                hit = _COMMAND_CACHE.get(key)
+                if hit is not None:
+                    return hit
+        res = self._check_command(cmd_spec)
+        if key is not None:
+            _remember(_COMMAND_CACHE, key, res)
+        return res
+
+    def _check_command(self, cmd_spec: Dict[str, Any]) -> GateResult:
         cmd = cmd_spec.get("cmd")
         expect_code = cmd_spec.get("exit_code", 0)
         expect_substr = cmd_spec.get("substr")
@@ -77,41 +176,17 @@ class GateRunner:
         return GateResult(True, "Command passed checks", {"command": cmd, "exit_code": res["exit_code"]})
 
     def check_db_rows(self, min_rows: int = 1) -> GateResult:
-        # Generic DB check: look for any .db file, if any table has rows
-        import glob
-        # We need to run this check OUTSIDE the agent, but effectively we are the orchestrator running it.
-        # Since we have direct filesystem access, we can try to use python's sqlite3 directly OR run it via shell to be safe/sandboxed.
-        # Running via shell is safer to match environment.
-        
-        py_script = (
-            "import glob, sqlite3; "
-            "dbs = glob.glob('*.db'); "
-            "max_rows = 0; "
-            "for db in dbs: "
-            "  try: "
-            "    c = sqlite3.connect(db).cursor(); "
-            "    tables = c.execute(\"SELECT name FROM sqlite_master WHERE type='table'\").fetchall(); "
-            "    for t in tables: "
-            "      c.execute(f'SELECT count(*) FROM {t[0]}'); "
-            "      max_rows = max(max_rows, c.fetchone()[0]); "
-            "  except: pass; "
-            "print(f'MAX_ROWS={max_rows}')"
-        )
-        
-        res = self.tools.run_shell_structured(f"python3 -c \"{py_script}\"")
-        if res["exit_code"] != 0:
-             return GateResult(False, "Failed to inspect DB files", {"error": res["stderr"]})
+        # Generic DB check: look for any .db file, if any table has min_rows rows.
+        dbs, counts, errors = scan_db_rows(self.tools.workspace_dir, stop_at=max(min_rows, 0))
+        max_rows = max((rows for _, _, rows in counts), default=0)
         
-        import re
-        m = re.search(r"MAX_ROWS=(\d+)", res["stdout"])
-        if m:
-            count = int(m.group(1))
-            if count >= min_rows:
-                return GateResult(True, f"Database has {count} rows (>= {min_rows})", {"rows": count})
-            else:
-                 return GateResult(False, f"Database has {count} rows (required {min_rows})", {"rows": count})
-        
-        return GateResult(False, "Could not determine row count", {"output": res["stdout"]})
+        # "rows" is capped at min_rows: the largest table holds at least that many
+        evidence: Dict[str, Any] = {"rows": max_rows, "databases": dbs}
+        if errors:
+            evidence["errors"] = errors
+        if max_rows >= min_rows:
+            return GateResult(True, f"Database has at least {min_rows} rows", evidence)
+        return GateResult(False, f"Database has {max_rows} rows (required {min_rows})", evidence)
 
     def run_apply_gates(self, patch_files: List[Any]) -> GateResult:
         # 1. Check existence
@@ -134,6 +209,7 @@ class GateRunner:
             results.append(self.check_files_exist(gates["must_exist"]))
 
         # Check 'must_run' / 'must_output_contains'
+        commands = []
         if "must_run" in gates:
             for cmd in gates["must_run"]:
                 # simple string or dict
@@ -141,13 +217,19 @@ class GateRunner:
                     c = {"cmd": cmd}
                 else:
                     c = cmd
-                results.append(self.check_command(c))
+                commands.append(c)
                 
         if "must_output_contains" in gates:
-             for item in gates["must_output_contains"]:
-                 results.append(self.check_command(item))
+             commands.extend(gates["must_output_contains"])
+        
+        if GATE_WORKERS > 1 and len(commands) > 1:
+            # Each command mostly waits on its subprocess; results keep spec order
+            with ThreadPoolExecutor(max_workers=min(GATE_WORKERS, len(commands))) as pool:
+                results.extend(pool.map(self.check_command, commands))
+        else:
+            results.extend(self.check_command(c) for c in commands)
 
-        # Check 'min_db_rows'
+        # Check 'min_db_rows' (after the commands, which may be what fills the DB)
         if "min_db_rows" in gates:
             results.append(self.check_db_rows(gates["min_db_rows"]))
             
@@ -1,23 +1,94 @@
+import hashlib
+import http.client
 import json
+import logging
 import os
+import random
 import re
-import sys
+import sqlite3
+import threading
 import time
-import urllib.error
-import urllib.request
-from typing import Any, Dict, Optional
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
 
-from .config import ACTIVE_LLM, ALLOWED_TYPES, LLM_CONFIGS, LLM_RETRIES, LLM_TIMEOUT, DEFAULT_TEMPERATURE
+from ._json import dumps, loads
+from .config import (ACTIVE_LLM, ALLOWED_TYPES, LLM_CACHE_MAX_TEMPERATURE, LLM_CACHE_TTL, LLM_CONFIGS, LLM_RETRIES,
+                     LLM_RETRY_MAX_DELAY, LLM_STREAM, LLM_TIMEOUT, DEFAULT_TEMPERATURE)
+
+log = logging.getLogger(__name__)
+
+_ENV_LOADED = False
+
+# Response-extraction patterns used by parse_single_json_object
+_THINK_RE = re.compile(r"<think>[\s\S]*?</think>", re.DOTALL)
+_COMMAND_RE = re.compile(r"@@@COMMAND_START@@@\s*(.*?)\s*@@@COMMAND_END@@@", re.DOTALL)
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", re.IGNORECASE)
+# raw_decode parses the first complete value from an offset and reports where it ended
+_DECODER = json.JSONDecoder()
+# After an early parse, how much of the stream's tail (finish_reason chunk, [DONE]) is read to keep the connection
+_STREAM_DRAIN_BYTES = 64 * 1024
+_STREAM_DRAIN_SECONDS = 2.0
+
+def _load_env_once() -> None:
+    """Load environment variables from .env file if present (first call only)"""
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    _ENV_LOADED = True
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait after failed attempt: the server's Retry-After if numeric, else capped exponential plus jitter"""
+    if retry_after:
+        try:
+            return min(LLM_RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # HTTP-date form; use the backoff instead
+    return min(LLM_RETRY_MAX_DELAY, 2 ** attempt) + random.random()
+
+class LLMHTTPError(Exception):
+    """Non-2xx response from the LLM endpoint"""
+    def __init__(self, code: int, body: str, headers: Dict[str, str]) -> None:
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.body = body
+        self.headers = headers
+
+class _ObjectScanner:
+    """Tracks JSON brace depth across streamed chunks (string/escape aware)"""
+    def __init__(self) -> None:
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+    
+    def feed(self, chunk: str) -> bool:
+        """Consume chunk; True if a top-level object closed inside it"""
+        closed = False
+        for ch in chunk:
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = self.depth > 0  # Quotes in surrounding prose don't open strings
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                closed = closed or self.depth == 0
+        return closed
 
 class LLMClient:
-    def __init__(self, log_path: Optional[str] = None) -> None:
+    def __init__(self, log_path: Optional[str] = None, cache_path: Optional[str] = None) -> None:
         self.log_path = log_path
-        # Load environment variables from .env file if present
-        try:
-            from dotenv import load_dotenv
-            load_dotenv()
-        except ImportError:
-            pass
+        _load_env_once()
         
         config = LLM_CONFIGS.get(ACTIVE_LLM, {})
         
@@ -31,12 +102,218 @@ class LLMClient:
             self.api_key = os.environ.get("LLM_API_KEY", "").strip()
 
         self.model = config.get("model") or os.environ.get("LLM_MODEL", "").strip() or "deepseek-chat"
+        self._cache_blocks = bool(config.get("prompt_cache_blocks"))
         
         if not self.api_key:
             raise RuntimeError("LLM_API_KEY environment variable is not set.")
         if not self.api_url:
             raise RuntimeError("LLM_API_URL environment variable is not set.")
+        
+        # One keep-alive connection per client and thread, reused across calls (no handshake per request)
+        parts = urllib.parse.urlsplit(self.api_url)
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._local = threading.local()
+        self._all_conns: List[http.client.HTTPConnection] = []  # every thread's connection, for close()
+        self._conns_lock = threading.Lock()
+        
+        # Exact-match response cache: in-memory, backed by sqlite when cache_path is set
+        self._mem_cache: Dict[str, Tuple[float, bytes]] = {}
+        self._cache_db: Optional[sqlite3.Connection] = None
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self._cache_lock = threading.Lock()
+            self._cache_db = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+            self._cache_db.execute("PRAGMA journal_mode=WAL")
+            self._cache_db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response BLOB, ts REAL)")
+            if "ts" not in {row[1] for row in self._cache_db.execute("PRAGMA table_info(llm_cache)")}:
+                self._cache_db.execute("ALTER TABLE llm_cache ADD COLUMN ts REAL DEFAULT 0")
+            if LLM_CACHE_TTL:
+                self._cache_db.execute("DELETE FROM llm_cache WHERE ts < ?", (time.time() - LLM_CACHE_TTL,))
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_cls = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+            conn = self._local.conn = conn_cls(self._host, self._port, timeout=LLM_TIMEOUT)
+            self._local.reused = False
+            with self._conns_lock:
+                self._all_conns.append(conn)
+        return conn
+
+    def _reset_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            with self._conns_lock:
+                if conn in self._all_conns:
+                    self._all_conns.remove(conn)
+
+    def close(self) -> None:
+        """Close every keep-alive connection and the response cache"""
+        with self._conns_lock:
+            conns, self._all_conns = self._all_conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+        if self._cache_db is not None:
+            with self._cache_lock:
+                self._cache_db.close()
+            self._cache_db = None
+
+    def __enter__(self) -> "LLMClient":
+        return self
 
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _cache_key(self, system: str, user: str, temperature: float, max_tokens: Optional[int]) -> str:
+        return hashlib.sha256(f"{self.model}|{temperature}|{max_tokens}|{system}|{user}".encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        hit = self._mem_cache.get(key)
+        if hit is None and self._cache_db is not None:
+            with self._cache_lock:
+                row = self._cache_db.execute("SELECT ts, response FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if row:
+                hit = self._mem_cache[key] = (row[0] or 0.0, bytes(row[1]))
+        if hit is None or (LLM_CACHE_TTL and time.time() - hit[0] > LLM_CACHE_TTL):
+            return None
+        # Decode per hit so callers can't mutate the cached copy
+        return loads(hit[1])
+
+    def _cache_put(self, key: Optional[str], obj: Dict[str, Any]) -> None:
+        if key is None:
+            return
+        ts = time.time()
+        raw = dumps(obj)
+        self._mem_cache[key] = (ts, raw)
+        if self._cache_db is not None:
+            try:
+                with self._cache_lock:
+                    self._cache_db.execute("INSERT OR REPLACE INTO llm_cache (key, response, ts) VALUES (?, ?, ?)", (key, raw, ts))
+            except sqlite3.Error as e:
+                log.debug("LLM cache write failed: %s", e)
+
+    def _open(self, body: bytes) -> http.client.HTTPResponse:
+        """POST body to the API on the persistent connection and return the (unread) response"""
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        while True:
+            conn = self._connection()
+            reused = self._local.reused
+            try:
+                conn.request("POST", self._path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The server dropped an idle keep-alive connection; reconnect once
+                self._reset_connection()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                self._reset_connection()
+                raise
+            self._local.reused = True
+            if resp.status >= 400:
+                raw = self._read(resp)
+                raise LLMHTTPError(resp.status, raw, dict(resp.getheaders()))
+            return resp
+
+    def _read(self, resp: http.client.HTTPResponse) -> str:
+        try:
+            return resp.read().decode("utf-8", errors="replace")
+        except Exception:
+            self._reset_connection()
+            raise
+
+    def _post(self, body: bytes) -> str:
+        """POST body and return the decoded response"""
+        return self._read(self._open(body))
+
+    def _complete(self, payload: Dict[str, Any]) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+        """Run one completion; returns (content, finish_reason, object parsed early from the stream or None)"""
+        if not LLM_STREAM:
+            raw = self._post(dumps(payload))
+            self._log_trace("OUTPUT", raw)
+            choice = loads(raw)["choices"][0]
+            return choice["message"]["content"], choice.get("finish_reason"), None
+        
+        resp = self._open(dumps(dict(payload, stream=True)))
+        if "text/event-stream" not in (resp.getheader("Content-Type") or ""):
+            # Endpoint ignored stream=true and answered in one piece
+            raw = self._read(resp)
+            self._log_trace("OUTPUT", raw)
+            choice = loads(raw)["choices"][0]
+            return choice["message"]["content"], choice.get("finish_reason"), None
+        
+        parts: List[str] = []
+        finish_reason = None
+        scanner = _ObjectScanner()
+        try:
+            for line in resp:
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choice = loads(data)["choices"][0]
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = (choice.get("delta") or {}).get("content") or ""
+                if not delta:
+                    continue
+                parts.append(delta)
+                # Try to parse as soon as a top-level object closes (outside any open <think> block)
+                if scanner.feed(delta):
+                    text = "".join(parts)
+                    if text.count("<think>") == text.count("</think>"):
+                        try:
+                            obj = parse_single_json_object(text)
+                        except Exception:
+                            continue
+                        finish_reason = self._drain_stream(resp, finish_reason)
+                        self._log_trace("OUTPUT", text)
+                        return text, finish_reason, obj
+            resp.read()  # Drain the terminating chunk so the connection stays reusable
+        except Exception:
+            self._reset_connection()
+            raise
+        content = "".join(parts)
+        self._log_trace("OUTPUT", content)
+        return content, finish_reason, None
+
+    def _drain_stream(self, resp: http.client.HTTPResponse, finish_reason: Optional[str]) -> Optional[str]:
+        """Read the usually tiny rest of a stream so the connection stays reusable; reset it past the drain limits"""
+        sock = self._local.conn.sock
+        budget = _STREAM_DRAIN_BYTES
+        deadline = time.monotonic() + _STREAM_DRAIN_SECONDS
+        try:
+            if sock is not None:
+                sock.settimeout(_STREAM_DRAIN_SECONDS)
+            for line in resp:
+                budget -= len(line)
+                if budget < 0 or time.monotonic() > deadline:
+                    self._reset_connection()  # A long tail isn't worth the wait; a new connection is cheaper
+                    return finish_reason
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                for choice in loads(data).get("choices") or ():
+                    finish_reason = choice.get("finish_reason") or finish_reason
+            resp.read()  # Terminating chunk
+            if sock is not None:
+                sock.settimeout(LLM_TIMEOUT)
+        except Exception:
+            self._reset_connection()
+        return finish_reason
+    
     def _log_trace(self, role: str, content: str) -> None:
         if not self.log_path:
             return
@@ -44,10 +321,36 @@ class LLMClient:
         with open(self.log_path, "a", encoding="utf-8") as f:
             f.write(f"[{ts}] [{role}] =========================\n{content}\n\n")
 
-    def chat_json(self, system: str, user: str, temperature: float = DEFAULT_TEMPERATURE, max_tokens: Optional[int] = None) -> Dict[str, Any]:
-        print(f"[DEBUG] LLM request model={self.model} max_tokens={max_tokens}", file=sys.stderr)
+    def _messages(self, system: str, prefix: str, user: str) -> List[Dict[str, Any]]:
+        """Build chat messages; the stable system/prefix text comes first so provider prompt caches can hit"""
+        if not self._cache_blocks:
+            return [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prefix + user},
+            ]
+        ephemeral = {"type": "ephemeral"}
+        user_blocks = [{"type": "text", "text": user}]
+        if prefix:
+            user_blocks.insert(0, {"type": "text", "text": prefix, "cache_control": ephemeral})
+        return [
+            {"role": "system", "content": [{"type": "text", "text": system, "cache_control": ephemeral}]},
+            {"role": "user", "content": user_blocks},
+        ]
+
+    def chat_json(self, system: str, user: str, temperature: float = DEFAULT_TEMPERATURE, max_tokens: Optional[int] = None,
+                  refresh_cache: bool = False, prefix: str = "") -> Dict[str, Any]:
+        """Call the LLM for one JSON object; prefix is the stable head of the user message, user the per-call tail"""
+        log.debug("LLM request model=%s max_tokens=%s", self.model, max_tokens)
         
-        self._log_trace("INPUT", f"SYSTEM:\n{system}\n\nUSER:\n{user}")
+        # Sampled (hot) calls are meant to vary, so only near-deterministic ones are cached
+        cache_key = self._cache_key(system, prefix + user, temperature, max_tokens) if temperature <= LLM_CACHE_MAX_TEMPERATURE else None
+        if cache_key is not None and not refresh_cache:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                log.debug("LLM cache hit")
+                return cached
+        
+        self._log_trace("INPUT", f"SYSTEM:\n{system}\n\nUSER:\n{prefix}{user}")
 
         retries = LLM_RETRIES
         truncation_warning = False
@@ -65,10 +368,7 @@ class LLMClient:
                     msg += " Please ensure valid JSON output."
                 current_user += msg
 
-            messages = [
-                {"role": "system", "content": system},
-                {"role": "user", "content": current_user},
-            ]
+            messages = self._messages(system, prefix, current_user)
             
             payload = {
                 "model": self.model,
@@ -79,108 +379,140 @@ class LLMClient:
                 payload["max_tokens"] = max_tokens
 
             try:
-                print(f"[DEBUG] sending request (attempt {attempt+1}/{retries})...", file=sys.stderr)
-                req = urllib.request.Request(
-                    self.api_url,
-                    method="POST",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.api_key}",
-                    },
-                    data=json.dumps(payload).encode("utf-8"),
-                )
-                with urllib.request.urlopen(req, timeout=LLM_TIMEOUT) as resp:
-                    raw = resp.read().decode("utf-8", errors="replace")
-                print("[DEBUG] response received", file=sys.stderr)
-                
-                self._log_trace("OUTPUT", raw)
-
-                data = json.loads(raw)
-                choice = data["choices"][0]
-                content = choice["message"]["content"]
+                log.debug("sending request (attempt %d/%d)...", attempt + 1, retries)
+                content, finish_reason, early = self._complete(payload)
+                log.debug("response received")
+                if early is not None:
+                    self._cache_put(cache_key, early)
+                    return early
                 
-                if choice.get("finish_reason") == "length":
+                if finish_reason == "length":
                     truncation_warning = True
-                    print(f"[DEBUG] Response truncated (finish_reason=length)", file=sys.stderr)
+                    log.debug("Response truncated (finish_reason=length)")
                 else:
                     truncation_warning = False
                 
                 try:
-                    return parse_single_json_object(content)
+                    obj = parse_single_json_object(content)
                 except Exception as parse_err:
                     parsed_error_msg = str(parse_err)
-                    print(f"[DEBUG] Parse error: {parse_err}", file=sys.stderr)
+                    log.debug("Parse error: %s", parse_err)
                     if attempt < retries - 1:
                         continue
                     else:
                         raise RuntimeError(f"LLM failed format after {retries} retries: {parse_err}")
+                self._cache_put(cache_key, obj)
+                return obj
                 
-            except urllib.error.HTTPError as e:
-                body = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else ""
-                print(f"[DEBUG] HTTP error: {getattr(e, 'code', '?')} {body[:200]}", file=sys.stderr)
+            except LLMHTTPError as e:
+                body = e.body
+                log.debug("HTTP error: %s %s", e.code, body[:200])
                 if attempt == retries - 1:
-                    raise RuntimeError(f"LLM HTTPError: {getattr(e, 'code', '?')} {body[:400]}")
+                    raise RuntimeError(f"LLM HTTPError: {e.code} {body[:400]}")
+                retry_after = next((v for k, v in e.headers.items() if k.lower() == "retry-after"), None)
+                delay = _retry_delay(attempt, retry_after)
+                log.debug("Retrying in %.1fs...", delay)
+                time.sleep(delay)
             except Exception as e:
-                print(f"[DEBUG] Error during LLM request/parsing: {e}", file=sys.stderr)
+                log.debug("Error during LLM request/parsing: %s", e)
                 if attempt == retries - 1:
                     raise RuntimeError(f"LLM request failed: {e}")
-                print("[DEBUG] Retrying...", file=sys.stderr)
+                delay = _retry_delay(attempt)
+                log.debug("Retrying in %.1fs...", delay)
+                time.sleep(delay)
         
         raise RuntimeError("LLM retries exhausted")
 
+# Required fields per response type: (field, required type or None for presence only, error)
+_SCHEMA_RULES: Dict[str, Tuple[Tuple[str, Optional[type], str], ...]] = {
+    "PATCH": (("files", list, "PATCH missing 'files' list"),),
+    "PLAN": (("steps", list, "PLAN missing 'steps' list"),),
+    "SPECIFICATION": (("requirements", list, "SPECIFICATION missing 'requirements' list"),),
+    "TEST_REPORT": (("success", None, "TEST_REPORT missing 'success' boolean"),),
+    "COMMAND": (("command", None, "COMMAND missing 'command' string"),),
+    "COMMAND_BATCH": (("commands", list, "COMMAND_BATCH missing 'commands' list"),),
+}
+# Extra fields for specific commands
+_COMMAND_RULES: Dict[str, Tuple[Tuple[str, Optional[type], str], ...]] = {
+    "run_shell": (("args", str, "COMMAND run_shell requires 'args' string"),),
+    "write_file": (("file", str, "COMMAND write_file requires 'file' string"),
+                   ("content", str, "COMMAND write_file requires 'content' string")),
+    "read_files": (("files", list, "COMMAND read_files requires 'files' list"),),
+    "verify_url": (("args", str, "COMMAND verify_url requires 'args' string"),),
+    "verify_urls": (("args", list, "COMMAND verify_urls requires 'args' list"),),
+}
+_PATCH_FILE_KEYS = ("path", "content", "action")
+_REVIEW_STATUSES = frozenset(("APPROVE", "REJECT"))
+
+def _check_rules(obj: Dict[str, Any], rules: Tuple[Tuple[str, Optional[type], str], ...]) -> None:
+    for key, typ, error in rules:
+        if key not in obj or (typ is not None and not isinstance(obj[key], typ)):
+            raise RuntimeError(error)
+
 def validate_schema(obj: Dict[str, Any]) -> None:
     t = obj.get("type")
+    rules = _SCHEMA_RULES.get(t)
+    if rules:
+        _check_rules(obj, rules)
     if t == "PATCH":
-        if "files" not in obj or not isinstance(obj["files"], list):
-            raise RuntimeError("PATCH missing 'files' list")
-        for f in obj["files"]:
-            if "path" not in f or "content" not in f or "action" not in f:
-                raise RuntimeError("PATCH file entry missing path/content/action")
-    elif t == "PLAN":
-        if "steps" not in obj or not isinstance(obj["steps"], list):
-            raise RuntimeError("PLAN missing 'steps' list")
-    elif t == "SPECIFICATION":
-        if "requirements" not in obj or not isinstance(obj["requirements"], list):
-            raise RuntimeError("SPECIFICATION missing 'requirements' list")
+        for i, f in enumerate(obj["files"]):
+            if not isinstance(f, dict) or any(k not in f for k in _PATCH_FILE_KEYS):
+                raise RuntimeError(f"PATCH file entry missing path/content/action (files[{i}])")
     elif t == "REVIEW":
-        if "status" not in obj or obj["status"] not in ["APPROVE", "REJECT"]:
+        if obj.get("status") not in _REVIEW_STATUSES:
             raise RuntimeError("REVIEW missing status (APPROVE/REJECT)")
-    elif t == "TEST_REPORT":
-        if "success" not in obj:
-            raise RuntimeError("TEST_REPORT missing 'success' boolean")
     elif t == "COMMAND":
-        if "command" not in obj:
-            raise RuntimeError("COMMAND missing 'command' string")
-        
-        # Validations for specific commands
-        cmd = obj["command"]
-        if cmd == "run_shell":
-            if "args" not in obj or not isinstance(obj["args"], str):
-                raise RuntimeError("COMMAND run_shell requires 'args' string")
-        elif cmd == "write_file":
-            if "file" not in obj or not isinstance(obj["file"], str):
-                raise RuntimeError("COMMAND write_file requires 'file' string")
-            if "content" not in obj or not isinstance(obj["content"], str):
-                raise RuntimeError("COMMAND write_file requires 'content' string")
-        elif cmd == "read_files":
-            if "files" not in obj or not isinstance(obj["files"], list):
-                raise RuntimeError("COMMAND read_files requires 'files' list")
-        elif cmd == "verify_url":
-            if "args" not in obj or not isinstance(obj["args"], str):
-                raise RuntimeError("COMMAND verify_url requires 'args' string")
+        cmd_rules = _COMMAND_RULES.get(obj["command"]) if isinstance(obj["command"], str) else None
+        if cmd_rules:
+            _check_rules(obj, cmd_rules)
+    elif t == "COMMAND_BATCH":
+        for i, c in enumerate(obj["commands"]):
+            if not isinstance(c, dict) or not isinstance(c.get("command"), str):
+                raise RuntimeError(f"COMMAND_BATCH entry missing 'command' string (commands[{i}])")
+            cmd_rules = _COMMAND_RULES.get(c["command"])
+            if cmd_rules:
+                _check_rules(c, cmd_rules)
 
 
 def parse_single_json_object(text: str) -> Dict[str, Any]:
+    # A reply that is just the JSON object (the usual case) parses as-is
+    obj = None
+    stripped = text.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        try:
+            obj = loads(stripped)
+        except Exception:
+            pass
+    if obj is None:
+        obj = _extract_json_object(text)
+
+    if not isinstance(obj, dict):
+        raise RuntimeError("LLM output must be a JSON object")
+    
+    validate_schema(obj)
+    
+    t = obj.get("type")
+    if t not in ALLOWED_TYPES:
+        raise RuntimeError(f"Invalid or missing type: {t}")
+    return obj
+
+def _extract_json_object(text: str) -> Any:
+    """Strip think blocks / command markers / code fences around the object and decode it"""
+    # Each envelope regex runs only if its marker is present (a C-speed substring check)
     # Remove <think>...</think> blocks if present (common in reasoning models)
-    text = re.sub(r"<think>[\s\S]*?</think>", "", text, flags=re.DOTALL).strip()
+    if "<think>" in text:
+        text = _THINK_RE.sub("", text)
+    text = text.strip()
 
-    match = re.search(r"@@@COMMAND_START@@@\s*(.*?)\s*@@@COMMAND_END@@@", text, re.DOTALL)
-    if match:
-        text = match.group(1).strip()
+    if "@@@COMMAND_START@@@" in text:
+        match = _COMMAND_RE.search(text)
+        if match:
+            text = match.group(1).strip()
     
-    match_md = re.search(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", text, re.IGNORECASE)
-    if match_md:
-        text = match_md.group(1).strip()
+    if "```" in text:
+        match_md = _FENCE_RE.search(text)
+        if match_md:
+            text = match_md.group(1).strip()
     
     start = text.find("{")
     end = text.rfind("}")
@@ -188,18 +520,14 @@ def parse_single_json_object(text: str) -> Dict[str, Any]:
         text = text[start : end + 1]
 
     try:
-        obj = json.loads(text)
+        obj = loads(text)
     except Exception as e:
-        raise RuntimeError(f"Invalid JSON: {e} \nText: {text[:100]}...")
-
-    if not isinstance(obj, dict):
-        raise RuntimeError("LLM output must be a JSON object")
-    
-    validate_schema(obj)
-    
-    t = obj.get("type")
-    if t not in ALLOWED_TYPES:
-        raise RuntimeError(f"Invalid or missing type: {t}")
+        # Outermost braces didn't delimit one object (e.g. prose with braces after it):
+        # take the first complete object instead
+        try:
+            obj, _ = _DECODER.raw_decode(text)
+        except ValueError:
+            raise RuntimeError(f"Invalid JSON: {e} \nText: {text[:100]}...")
     return obj
 
 def assert_type(obj: Dict[str, Any], expected: str) -> None:
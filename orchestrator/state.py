@@ -1,13 +1,56 @@
-import json
+import hashlib
+import logging
+import operator
 import os
-import shutil
-import sys
+import sqlite3
+import threading
 import time
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 
+from ._json import dumps, loads
+from .config import MAX_STATE_BACKUPS, PATCH_BLOB_MIN_CHARS
 from .types import RunContext, State, TaskPacket
 
+log = logging.getLogger(__name__)
+
+_PACKET_FIELDS = ("objective", "workspace_dir", "files_allowed", "task_id")
+_CTX_FIELDS = ("frozen_spec", "plan", "patches", "test_reports", "spec_review",
+               "patch_review", "current_state", "iteration_count", "patch_seq", "report_seq")
+# Context fields whose objects are replaced, never mutated in place (see RunContext): their JSON is reused by identity
+_IDENTITY_FIELDS = frozenset(("frozen_spec", "plan", "spec_review", "patch_review"))
+_PACKET_GETTER = operator.attrgetter(*_PACKET_FIELDS)
+_CTX_GETTER = operator.attrgetter(*_CTX_FIELDS)
+
+def _write_durable(path: str, buf: bytes) -> None:
+    """Write buf to a temp file, fsync it and rename it over path: path only ever holds complete content"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp)
+        raise
+    os.close(fd)
+    os.replace(tmp, path)
+    # Make the rename itself durable (directories can't be opened on Windows)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _open_log(path: str, buffering: int) -> BinaryIO:
+    """Open an append-only log; O_DSYNC makes each buffered flush durable on its own"""
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_DSYNC", 0)
+    return os.fdopen(os.open(path, flags, 0o644), "ab", buffering=buffering)
+
 class StateManager:
     """Manages persistent state storage for the workflow"""
     
@@ -20,44 +63,183 @@ class StateManager:
         # Create a changelog directory for file history
         self.changelog_dir = os.path.join(self.state_dir, "changelogs")
         os.makedirs(self.changelog_dir, exist_ok=True)
-    
-    def save_context(self, ctx: RunContext) -> None:
-        """Save the entire context to disk"""
-        context_path = os.path.join(self.state_dir, "context.json")
-        # Convert to serializable format
-        context_dict = {
-            "packet": {
-                "objective": ctx.packet.objective,
-                "workspace_dir": ctx.packet.workspace_dir,
-                "files_allowed": list(ctx.packet.files_allowed),
-                "task_id": ctx.packet.task_id
-            },
-            "frozen_spec": ctx.frozen_spec,
-            "plan": ctx.plan,
-            "patches": ctx.patches,
-            "test_reports": ctx.test_reports,
-            "spec_review": ctx.spec_review,
-            "patch_review": ctx.patch_review,
-            "current_state": ctx.current_state.name,
-            "iteration_count": ctx.iteration_count
-        }
         
-        with open(context_path, 'w', encoding='utf-8') as f:
-            json.dump(context_dict, f, indent=2, ensure_ascii=False)
+        # Context and artifacts live in one WAL-mode sqlite db, opened once
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.state_dir, "state.db"),
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS context (id INTEGER PRIMARY KEY CHECK (id = 0), ts REAL, data BLOB)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS artifacts (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, ts REAL, data BLOB)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_name ON artifacts (name, id)")
+        # Artifact bodies stored once per content hash; artifacts rows point at them
+        self._db.execute("CREATE TABLE IF NOT EXISTS artifact_bodies (hash TEXT PRIMARY KEY, data BLOB)")
+        if "hash" not in {row[1] for row in self._db.execute("PRAGMA table_info(artifacts)")}:
+            self._db.execute("ALTER TABLE artifacts ADD COLUMN hash TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_hash ON artifacts (hash)")
+        # Writes queued inside batch(), committed together at its end
+        self._pending: Optional[List[Tuple[str, Tuple[Any, ...]]]] = None
+        self._pending_artifacts: Dict[str, bytes] = {}
+        # _IDENTITY_FIELDS name -> (object, JSON bytes) as of the last save_context
+        self._field_bytes: Dict[str, Tuple[Any, bytes]] = {}
+        # id(artifact) -> (artifact, JSON bytes) saved since the last save_context; the entry
+        # references its object, so the id can't be recycled while it is here
+        self._artifact_bytes: Dict[int, Tuple[Any, bytes]] = {}
+        # Digest of the context row last written by this manager
+        self._last_ctx_hash: Optional[bytes] = None
+        
+        # Append-only snapshot log per agent, opened lazily
+        self._changelog_fh: Dict[str, BinaryIO] = {}
+        
+        # Content-addressed snapshot bodies, written once per unique version
+        self.blobs_dir = os.path.join(self.changelog_dir, "blobs")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._known_blobs = set()
+        # id(content) -> (content, hash) for the patch bodies of the last saved context (rebuilt each save)
+        self._content_refs: Dict[int, Tuple[str, str]] = {}
         
-        # Also save a backup with timestamp
-        backup_path = os.path.join(self.state_dir, f"context_backup_{int(time.time())}.json")
-        shutil.copy2(context_path, backup_path)
+        # file_path -> snapshot records, persisted as changelogs/index.jsonl
+        self._index_path = os.path.join(self.changelog_dir, "index.jsonl")
+        self._index_fh: Optional[BinaryIO] = None
+        self._history_index: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._load_history_index()
+    
+    def _serialize_context(self, ctx: RunContext) -> Dict[str, Any]:
+        """Context as a JSON-ready dict (tuples such as files_allowed serialize as arrays as-is)"""
+        packet = dict(zip(_PACKET_FIELDS, _PACKET_GETTER(ctx.packet)))
+        context_dict = dict(zip(_CTX_FIELDS, _CTX_GETTER(ctx)))
+        context_dict["current_state"] = context_dict["current_state"].name
+        # Only bodies still in ctx.patches stay referenced, so evicted patches can be freed
+        previous, self._content_refs = self._content_refs, {}
+        context_dict["patches"] = [self._patch_by_ref(p, previous) for p in ctx.patches]
+        context_dict["test_reports"] = list(ctx.test_reports)
+        return {"packet": packet, **context_dict}
+    
+    def save_context(self, ctx: RunContext) -> None:
+        """Save the entire context to disk (skipped when it serializes to what was last saved)"""
+        data = self._encode_context(self._serialize_context(ctx))
+        h = hashlib.blake2b(data, digest_size=16).digest()
+        if h == self._last_ctx_hash:
+            return
+        self._execute([("INSERT OR REPLACE INTO context (id, ts, data) VALUES (0, ?, ?)",
+                        (time.time(), data))])
+        self._last_ctx_hash = h
+    
+    def _execute(self, statements: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        """Run write statements now, or queue them while a batch() is open"""
+        with self._db_lock:
+            if self._pending is not None:
+                self._pending.extend(statements)
+                return
+            self._commit(statements)
+    
+    def _commit(self, statements: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        """Apply statements in one transaction (caller holds _db_lock)"""
+        if not statements:
+            return
+        self._db.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                self._db.execute(sql, params)
+        except Exception:
+            self._db.execute("ROLLBACK")
+            self._last_ctx_hash = None  # The queued context may not have been written
+            raise
+        self._db.execute("COMMIT")
+    
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Queue artifact/context saves and commit them in a single transaction on exit"""
+        with self._db_lock:
+            if self._pending is not None:
+                nested = True
+            else:
+                nested, self._pending = False, []
+        if nested:
+            yield
+            return
+        try:
+            yield
+        finally:
+            with self._db_lock:
+                statements, self._pending = self._pending, None
+                self._pending_artifacts.clear()
+                self._commit(statements)
+    
+    def _encode_context(self, context_dict: Dict[str, Any]) -> bytes:
+        """dumps(context_dict), splicing in bytes already encoded for the same spec/plan/review objects"""
+        parts = []
+        for key, value in context_dict.items():
+            if key in _IDENTITY_FIELDS and value is not None:
+                hit = self._field_bytes.get(key)
+                if hit is None or hit[0] is not value:
+                    hit = self._artifact_bytes.get(id(value))
+                if hit is None or hit[0] is not value:
+                    hit = (value, dumps(value))
+                self._field_bytes[key] = hit
+                data = hit[1]
+            else:
+                data = dumps(value)
+            parts.append(dumps(key) + b":" + data)
+        self._artifact_bytes.clear()
+        return b"{" + b",".join(parts) + b"}"
+    
+    def _content_ref(self, content: str, previous: Dict[int, Tuple[str, str]]) -> str:
+        """Blob hash for a patch body, hashing each distinct string object only once while it stays in the context"""
+        hit = self._content_refs.get(id(content)) or previous.get(id(content))
+        if hit is None or hit[0] is not content:
+            hit = (content, self._store_blob(content))
+        self._content_refs[id(content)] = hit
+        return hit[1]
+    
+    def _patch_by_ref(self, patch: Dict[str, Any], previous: Dict[int, Tuple[str, str]]) -> Dict[str, Any]:
+        """Persisted form of a patch: long file bodies become content_ref blob hashes"""
+        files = patch.get("files")
+        if not isinstance(files, list):
+            return patch
+        out = []
+        for f in files:
+            content = f.get("content") if isinstance(f, dict) else None
+            if isinstance(content, str) and len(content) >= PATCH_BLOB_MIN_CHARS:
+                f = {k: v for k, v in f.items() if k != "content"}
+                f["content_ref"] = self._content_ref(content, previous)
+            out.append(f)
+        return dict(patch, files=out)
+    
+    def _patch_from_ref(self, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """Inverse of _patch_by_ref"""
+        files = patch.get("files")
+        if not isinstance(files, list) or not any(isinstance(f, dict) and "content_ref" in f for f in files):
+            return patch
+        out = []
+        for f in files:
+            if isinstance(f, dict) and "content_ref" in f:
+                f = dict(f)
+                ref = f.pop("content_ref")
+                content = self.load_blob(ref)
+                # A lost or damaged body fails the load like a corrupt context, rather than resuming with an empty file
+                if content is None or hashlib.sha256(content.encode("utf-8")).hexdigest() != ref:
+                    raise RuntimeError(f"patch body {ref} missing or damaged")
+                f["content"] = content
+            out.append(f)
+        return dict(patch, files=out)
     
     def load_context(self) -> Optional[RunContext]:
         """Load context from disk if it exists"""
+        with self._db_lock:
+            row = self._db.execute("SELECT data FROM context WHERE id = 0").fetchone()
         context_path = os.path.join(self.state_dir, "context.json")
-        if not os.path.exists(context_path):
+        if row is None and not os.path.exists(context_path):
             return None
         
         try:
-            with open(context_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            if row is not None:
+                data = loads(row[0])
+            else:
+                # Workspace saved before state.db existed
+                with open(context_path, 'rb') as f:
+                    data = loads(f.read())
             
             packet = TaskPacket(
                 objective=data["packet"]["objective"],
@@ -69,65 +251,166 @@ class StateManager:
             ctx = RunContext(packet=packet)
             ctx.frozen_spec = data.get("frozen_spec")
             ctx.plan = data.get("plan")
-            ctx.patches = data.get("patches", [])
-            ctx.test_reports = data.get("test_reports", [])
+            ctx.patches.extend(self._patch_from_ref(p) for p in data.get("patches", []))
+            ctx.test_reports.extend(data.get("test_reports", []))
             ctx.spec_review = data.get("spec_review")
             ctx.patch_review = data.get("patch_review")
             ctx.current_state = State[data.get("current_state", "SPEC")]
             ctx.iteration_count = data.get("iteration_count", 0)
+            # Contexts saved before the counters existed kept every entry
+            ctx.patch_seq = data.get("patch_seq", len(data.get("patches", [])))
+            ctx.report_seq = data.get("report_seq", len(data.get("test_reports", [])))
             
             return ctx
         except Exception as e:
-            print(f"[DEBUG] Failed to load context: {e}", file=sys.stderr)
+            log.debug("Failed to load context: %s", e)
             return None
     
-    def save_artifact(self, name: str, artifact: Dict[str, Any]) -> None:
-        """Save a specific artifact (spec, plan, patch, etc.)"""
-        artifact_dir = os.path.join(self.state_dir, "artifacts")
-        os.makedirs(artifact_dir, exist_ok=True)
-        
-        artifact_path = os.path.join(artifact_dir, f"{name}_{int(time.time())}.json")
-        with open(artifact_path, 'w', encoding='utf-8') as f:
-            json.dump(artifact, f, indent=2, ensure_ascii=False)
+    def save_artifact(self, name: str, artifact: Dict[str, Any]) -> bytes:
+        """Save a specific artifact (spec, plan, patch, etc.), keeping the last MAX_STATE_BACKUPS per name; returns its JSON bytes"""
+        data = dumps(artifact)
+        self._artifact_bytes[id(artifact)] = (artifact, data)
+        h = hashlib.sha256(data).hexdigest()
+        # A body repeated under any name (e.g. a stuck repair loop) is stored only once.
+        # Pruning is per name, so unique names (patch_N, test_report_N, ...) are never pruned;
+        # only bodies released by this name's pruned rows are checked for other references.
+        pruned = ("SELECT id FROM artifacts WHERE name = ?1 AND id NOT IN "
+                  "(SELECT id FROM artifacts WHERE name = ?1 ORDER BY id DESC LIMIT ?2)")
+        self._execute([
+            ("INSERT OR IGNORE INTO artifact_bodies (hash, data) VALUES (?, ?)", (h, data)),
+            ("INSERT INTO artifacts (name, ts, hash) VALUES (?, ?, ?)", (name, time.time(), h)),
+            (f"DELETE FROM artifact_bodies WHERE hash IN (SELECT hash FROM artifacts WHERE id IN ({pruned})) "
+             f"AND NOT EXISTS (SELECT 1 FROM artifacts a WHERE a.hash = artifact_bodies.hash AND a.id NOT IN ({pruned}))",
+             (name, MAX_STATE_BACKUPS)),
+            (f"DELETE FROM artifacts WHERE id IN ({pruned})", (name, MAX_STATE_BACKUPS)),
+        ])
+        with self._db_lock:
+            if self._pending is not None:
+                self._pending_artifacts[name] = data
+        return data
     
-    def save_file_snapshot(self, file_path: str, content: str, agent: str) -> None:
-        """Save a snapshot of a file before modification"""
-        snapshot_dir = os.path.join(self.changelog_dir, agent)
-        os.makedirs(snapshot_dir, exist_ok=True)
+    def load_artifact(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the most recently saved artifact with this name"""
+        with self._db_lock:
+            data = self._pending_artifacts.get(name)
+            if data is not None:
+                return loads(data)
+            # Rows written before artifact_bodies existed carry their own data
+            row = self._db.execute("SELECT coalesce(a.data, b.data) FROM artifacts a "
+                                   "LEFT JOIN artifact_bodies b ON a.hash = b.hash "
+                                   "WHERE a.name = ? ORDER BY a.id DESC LIMIT 1", (name,)).fetchone()
+        return loads(row[0]) if row else None
+    
+    def _load_history_index(self) -> None:
+        """Load the path -> snapshot index, rebuilding it from agent logs if missing and importing legacy .snapshot files"""
+        rebuilt = not os.path.isfile(self._index_path)
+        agent_dirs = [d for d in os.listdir(self.changelog_dir)
+                      if d != "blobs" and os.path.isdir(os.path.join(self.changelog_dir, d))]
+        if rebuilt:
+            sources = [os.path.join(self.changelog_dir, d, "log.jsonl") for d in agent_dirs]
+        else:
+            sources = [self._index_path]
         
-        snapshot_path = os.path.join(snapshot_dir, 
-                                   f"{Path(file_path).name}_{int(time.time())}.snapshot")
+        records = []
+        for path in sources:
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        records.append(loads(line))
+                    except Exception:
+                        continue
+        
+        # Per-snapshot JSON files from before the logs existed (content inline), imported once each
+        imported = {r.get("legacy_snapshot") for r in records}
+        legacy = []
+        for d in agent_dirs:
+            for name in os.listdir(os.path.join(self.changelog_dir, d)):
+                key = f"{d}/{name}"
+                if not name.endswith(".snapshot") or key in imported:
+                    continue
+                try:
+                    with open(os.path.join(self.changelog_dir, key), 'rb') as f:
+                        record = loads(f.read())
+                except Exception:
+                    continue
+                content = record.pop("content", None)
+                if isinstance(content, str):
+                    record["hash"] = self._store_blob(content)
+                record["legacy_snapshot"] = key
+                legacy.append(record)
+        records.extend(legacy)
         
+        # Persist a rebuilt or extended index whole before anything is appended to it, or the next
+        # load would trust an index.jsonl holding only the new records
+        if legacy or (rebuilt and records):
+            _write_durable(self._index_path, b"".join(dumps(r) + b"\n" for r in records))
+        for record in records:
+            self._history_index[record.get("file_path")].append(record)
+    
+    def _changelog(self, agent: str) -> BinaryIO:
+        """Return the append handle for an agent's snapshot log"""
+        fh = self._changelog_fh.get(agent)
+        if fh is None:
+            agent_dir = os.path.join(self.changelog_dir, agent)
+            os.makedirs(agent_dir, exist_ok=True)
+            fh = _open_log(os.path.join(agent_dir, "log.jsonl"), 1 << 20)
+            self._changelog_fh[agent] = fh
+        return fh
+    
+    def _store_blob(self, content: Union[str, bytes]) -> str:
+        """Store content (str, or raw file bytes stored verbatim) under its SHA-256 and return the hash"""
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        h = hashlib.sha256(data).hexdigest()
+        if h not in self._known_blobs:
+            blob_path = os.path.join(self.blobs_dir, f"{h}.txt")
+            # A blob file exists only once complete, so an existing one can be trusted
+            if not os.path.exists(blob_path):
+                _write_durable(blob_path, data)
+            self._known_blobs.add(h)
+        return h
+    
+    def load_blob(self, h: str) -> Optional[str]:
+        """Return the content stored under a snapshot hash"""
+        try:
+            with open(os.path.join(self.blobs_dir, f"{h}.txt"), 'rb') as f:
+                return f.read().decode("utf-8", errors="replace")
+        except OSError:
+            return None
+    
+    def save_file_snapshot(self, file_path: str, content: Union[str, bytes], agent: str) -> None:
+        """Save a snapshot of a file before modification"""
         snapshot_data = {
             "timestamp": time.time(),
             "agent": agent,
             "file_path": file_path,
-            "content": content,
+            "hash": self._store_blob(content),
             "task_id": self.task_id
         }
+        line = dumps(snapshot_data) + b"\n"
+        self._changelog(agent).write(line)
         
-        with open(snapshot_path, 'w', encoding='utf-8') as f:
-            json.dump(snapshot_data, f, indent=2, ensure_ascii=False)
-    
-    def get_file_history(self, file_path: str) -> List[Dict[str, Any]]:
-        """Get the change history of a specific file"""
-        history = []
-        for agent_dir in os.listdir(self.changelog_dir):
-            agent_path = os.path.join(self.changelog_dir, agent_dir)
-            if not os.path.isdir(agent_path):
-                continue
-            
-            for snapshot_file in os.listdir(agent_path):
-                if snapshot_file.endswith('.snapshot'):
-                    snapshot_path = os.path.join(agent_path, snapshot_file)
-                    try:
-                        with open(snapshot_path, 'r', encoding='utf-8') as f:
-                            snapshot = json.load(f)
-                            if snapshot.get("file_path") == file_path:
-                                history.append(snapshot)
-                    except:
-                        continue
+        if self._index_fh is None:
+            self._index_fh = _open_log(self._index_path, 1 << 16)
+        self._index_fh.write(line)
+        self._history_index[file_path].append(snapshot_data)
+    
+    def flush_snapshots(self) -> None:
+        """Flush buffered snapshot records to disk (once per agent step)"""
+        for fh in self._changelog_fh.values():
+            fh.flush()
+        if self._index_fh is not None:
+            self._index_fh.flush()
+    
+    def get_file_history(self, file_path: str, with_content: bool = True) -> List[Dict[str, Any]]:
+        """Get the change history of a specific file (content resolved from blobs on request)"""
+        history = [dict(r) for r in self._history_index.get(file_path, [])]
         
         # Sort by timestamp
         history.sort(key=lambda x: x.get("timestamp", 0))
+        if with_content:
+            for snapshot in history:
+                if "content" not in snapshot and "hash" in snapshot:
+                    snapshot["content"] = self.load_blob(snapshot["hash"])
         return history
@@ -1,29 +1,173 @@
+import bisect
+import hashlib
+import logging
+import mmap
 import os
 import re
+import selectors
+import shlex
+import signal
 import shutil
 import subprocess
-import sys
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from .state import StateManager
-from .config import ALLOWED_COMMANDS, BLACKLIST_PATTERNS, MAX_FILE_LIST_LIMIT, MAX_FILE_READ_BYTES, SHELL_TIMEOUT, SHELL_BACKGROUND_TIMEOUT
+from .config import ALLOWED_COMMANDS, BLACKLIST_PATTERNS, MAX_FILE_LIST_LIMIT, MAX_FILE_READ_BYTES, MAX_PROMPT_FILE_LIST, MAX_SEARCH_RESULTS, MAX_SEARCH_RESULTS_PER_FILE, MMAP_SEARCH_THRESHOLD, READ_CACHE_MAX_FILES, SHELL_TIMEOUT, SHELL_BACKGROUND_TIMEOUT, USE_PERSISTENT_SHELL
+
+log = logging.getLogger(__name__)
+
+# Workspace file index shared by all agents: workspace_dir -> (dir mtimes, sorted files)
+_LIST_CACHE: Dict[str, Tuple[Dict[str, int], List[str]]] = {}
+# Prompt rendering of that index: (workspace_dir, limit) -> (files list it was built from, text)
+_LIST_TEXT_CACHE: Dict[Tuple[str, int], Tuple[List[str], str]] = {}
+# (workspace, suffixes) -> (file index it was filtered from, matching paths)
+_SUFFIX_CACHE: Dict[Tuple[str, Tuple[str, ...]], Tuple[List[str], List[str]]] = {}
+
+_NEWLINE_RE = re.compile("\n")
+# One pass over the command for the common (clean) case; the offending pattern is looked up only on a hit
+_BLACKLIST_RE = re.compile("|".join(f"(?:{p})" for p in BLACKLIST_PATTERNS))
+_BACKGROUND_RE = re.compile(r"(^|\s)&\s*$")
+# Anything the shell must interpret; commands without these are exec'd directly
+_SHELL_META_RE = re.compile(r"[|&;<>()$`\\*?\[\]{}~!#\n]")
+# Builtins whose effect would outlive the command in a persistent shell
+_SHELL_STATE_RE = re.compile(r"(^|[;&|({]\s*)(export|unset|set|exec|exit|source|\.|alias|ulimit|umask|trap|shopt)(\s|$)")
+
+# File contents shared by every agent: abs path -> (mtime_ns, size, bytes read)
+_READ_CACHE: Dict[str, Tuple[int, int, bytes]] = {}
+# mtimes have coarse (tick) granularity; files changed this recently aren't cached
+_READ_CACHE_MIN_AGE_NS = 1_000_000_000
+
+# One read pool per process, shared by every tools instance (created on first batch)
+_READ_POOL: Optional[ThreadPoolExecutor] = None
+# Guards _READ_CACHE updates (made from pool workers) and the lazy pool creation
+_READ_LOCK = threading.Lock()
+
+def _read_pool() -> ThreadPoolExecutor:
+    global _READ_POOL
+    with _READ_LOCK:
+        if _READ_POOL is None:
+            _READ_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="read")
+        return _READ_POOL
+
+# Directories never worth listing or searching; pruned before descending
+_SKIP_DIRS = frozenset((".agent_state", ".git", "__pycache__", ".venv", "node_modules"))
+
+# One long-lived bash per workspace (USE_PERSISTENT_SHELL)
+_SHELLS: Dict[str, "_PersistentShell"] = {}
+_SHELLS_LOCK = threading.Lock()
+
+
+class _PersistentShell:
+    """A bash process fed commands on stdin; each command's end is marked by a per-call sentinel"""
+    
+    def __init__(self, cwd: str) -> None:
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.proc: Optional[subprocess.Popen] = None
+    
+    def _start(self) -> subprocess.Popen:
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(
+                ["bash", "--noprofile", "--norc", "-s"],
+                cwd=self.cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,  # Own process group, so a timeout can kill the whole tree
+            )
+        return self.proc
+    
+    def close(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.proc.wait()
+        self.proc = None
+    
+    def run(self, command: str, timeout: float) -> Tuple[int, str, str]:
+        """Run command from the workspace root; returns (exit code, stdout, stderr)"""
+        with self.lock:
+            proc = self._start()
+            end = f"__END_{os.urandom(8).hex()}__".encode()
+            # eval of a quoted literal: an unbalanced quote or heredoc in command fails inside eval
+            # (exit 2, syntax error on stderr) instead of swallowing the sentinel lines below.
+            # The subshell keeps assignments, functions and cd from leaking into later commands.
+            script = (f"cd {shlex.quote(self.cwd)}\n( eval -- {shlex.quote(command)} ) </dev/null\n__rc=$?\n"
+                      f"printf '\\n%s %d\\n' {end.decode()} $__rc\nprintf '\\n%s\\n' {end.decode()} >&2\n")
+            try:
+                proc.stdin.write(script.encode("utf-8"))
+                proc.stdin.flush()
+            except OSError:
+                self.close()
+                raise RuntimeError("persistent shell exited")
+
+            out, err = bytearray(), bytearray()
+            marker = b"\n" + end
+            sel = selectors.DefaultSelector()
+            sel.register(proc.stdout, selectors.EVENT_READ, out)
+            sel.register(proc.stderr, selectors.EVENT_READ, err)
+            deadline = time.monotonic() + timeout
+            try:
+                while sel.get_map():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.close()
+                        raise subprocess.TimeoutExpired(command, timeout)
+                    for key, _ in sel.select(remaining):
+                        chunk = os.read(key.fd, 1 << 16)
+                        buf = key.data
+                        buf += chunk
+                        if not chunk or (buf.endswith(b"\n") and marker in buf[-(len(marker) + 16):]):
+                            sel.unregister(key.fileobj)
+            finally:
+                sel.close()
+            
+            i, j = out.rfind(marker), err.rfind(marker)
+            if i < 0 or j < 0:
+                self.close()  # Shell died mid-command; the next call starts a fresh one
+                return -1, out.decode("utf-8", errors="replace"), err.decode("utf-8", errors="replace")
+            code = int(out[i + len(marker):].strip() or -1)
+            return code, out[:i].decode("utf-8", errors="replace"), err[:j].decode("utf-8", errors="replace")
+
+
+def _persistent_shell(workspace_dir: str) -> _PersistentShell:
+    with _SHELLS_LOCK:
+        shell = _SHELLS.get(workspace_dir)
+        if shell is None:
+            shell = _SHELLS[workspace_dir] = _PersistentShell(workspace_dir)
+        return shell
 
 
 class PersistentTools:
     def __init__(self, workspace_dir: str, files_allowed: Tuple[str, ...], 
                  state_manager: StateManager, agent_name: str) -> None:
         self.workspace_dir = os.path.abspath(workspace_dir)
-        self.files_allowed = set(files_allowed)
+        # Symlink-resolved root, computed once; all path checks compare against it
+        self._workspace_real = os.path.realpath(workspace_dir)
+        # realpath output is normalized, so a prefix test is an exact containment check
+        self._workspace_prefix = os.path.join(self._workspace_real, "")
+        self.files_allowed = frozenset(files_allowed)
         self.state_manager = state_manager
         self.agent_name = agent_name
         
         # Track files we've read/written in this session
         self.files_accessed = set()
         self.files_modified = set()
+        
+        # rel_path -> (content hash, size, mtime_ns) as of our last write
+        self._last_hash: Dict[str, Tuple[str, int, int]] = {}
     
     def _abs(self, rel_path: str) -> str:
-        p = os.path.abspath(os.path.join(self.workspace_dir, rel_path))
-        if not p.startswith(self.workspace_dir + os.sep) and p != self.workspace_dir:
+        # realpath so a symlink inside the workspace can't point the check outside it.
+        # Not memoized: a link created later must still be resolved.
+        root = self._workspace_real
+        p = os.path.realpath(os.path.join(root, rel_path))
+        if p != root and not p.startswith(self._workspace_prefix):
             raise RuntimeError("path escape blocked")
         return p
 
@@ -33,49 +177,152 @@ class PersistentTools:
         if self.files_allowed and rel_path not in self.files_allowed:
             raise RuntimeError(f"file not allowed: {rel_path}")
 
-    def list_files(self, limit: int = MAX_FILE_LIST_LIMIT) -> List[str]:
+    def _scan_files(self) -> Tuple[Dict[str, int], List[str]]:
+        """Walk the workspace with os.scandir, recording each directory's mtime"""
+        dir_mtimes: Dict[str, int] = {}
         out: List[str] = []
-        for root, _, files in os.walk(self.workspace_dir):
-            for fn in files:
-                ap = os.path.join(root, fn)
-                rp = os.path.relpath(ap, self.workspace_dir)
-                # if rp == "main.py":
-                #    continue
-                if rp.startswith(".agent_state"):
-                    continue  # Skip state files
-                out.append(rp)
+        stack = [(self.workspace_dir, "")]
+        while stack:
+            dir_path, prefix = stack.pop()
+            try:
+                dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+                entries = list(os.scandir(dir_path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.is_symlink():
+                        continue  # Like os.walk, don't descend into linked dirs
+                    if entry.name in _SKIP_DIRS:
+                        continue  # Skip state/VCS/cache trees entirely
+                    stack.append((entry.path, prefix + entry.name + os.sep))
+                else:
+                    out.append(prefix + entry.name)
         out.sort()
-        return out[:limit]
+        return dir_mtimes, out
+
+    def _all_files(self) -> List[str]:
+        """Sorted workspace files, served from cache while no directory changed"""
+        cached = _LIST_CACHE.get(self.workspace_dir)
+        if cached is not None:
+            dir_mtimes, files = cached
+            try:
+                if all(os.stat(d).st_mtime_ns == m for d, m in dir_mtimes.items()):
+                    return files
+            except OSError:
+                pass
+        cached = self._scan_files()
+        _LIST_CACHE[self.workspace_dir] = cached
+        return cached[1]
+
+    def _invalidate_listing(self) -> None:
+        _LIST_CACHE.pop(self.workspace_dir, None)
+
+    def list_files(self, limit: int = MAX_FILE_LIST_LIMIT) -> List[str]:
+        return self._all_files()[:limit]
+    
+    def list_files_text(self, limit: int = MAX_PROMPT_FILE_LIST) -> str:
+        """Workspace listing for prompts: one path per line, capped at limit, rebuilt only when the index changes"""
+        files = self._all_files()
+        key = (self.workspace_dir, limit)
+        cached = _LIST_TEXT_CACHE.get(key)
+        if cached is not None and cached[0] is files:
+            return cached[1]
+        text = "\n".join(files[:limit])
+        if len(files) > limit:
+            text += f"\n... {len(files) - limit} more"
+        _LIST_TEXT_CACHE[key] = (files, text)
+        return text
+    
+    def files_with_suffix(self, suffixes: Tuple[str, ...]) -> List[str]:
+        """Sorted workspace files ending in any of suffixes, refiltered only when the index changes"""
+        files = self._all_files()
+        key = (self.workspace_dir, suffixes)
+        cached = _SUFFIX_CACHE.get(key)
+        if cached is None or cached[0] is not files:
+            cached = _SUFFIX_CACHE[key] = (files, [f for f in files if f.endswith(suffixes)])
+        return cached[1]
     
     def file_exists(self, rel_path: str) -> bool:
         """Check if a file exists"""
         ap = self._abs(rel_path)
         return os.path.exists(ap)
+    
+    def files_exist(self, rel_paths: List[str]) -> Dict[str, bool]:
+        """file_exists for many paths: one scandir per parent directory instead of a resolve + stat per path"""
+        by_dir: Dict[str, List[str]] = {}
+        for p in rel_paths:
+            by_dir.setdefault(os.path.dirname(os.path.normpath(p)), []).append(p)
+        
+        out: Dict[str, bool] = {}
+        for d, group in by_dir.items():
+            try:
+                with os.scandir(self._abs(d)) as it:
+                    entries = {e.name: e for e in it}
+            except (FileNotFoundError, NotADirectoryError):
+                entries = {}
+            for p in group:
+                name = os.path.basename(os.path.normpath(p))
+                entry = entries.get(name)
+                if name in ("", ".", "..") or (entry is not None and entry.is_symlink()):
+                    out[p] = self.file_exists(p)  # Resolve (and escape-check) the link target
+                else:
+                    out[p] = entry is not None
+        return out
 
     def read_text(self, rel_path: str, max_bytes: int = MAX_FILE_READ_BYTES) -> str:
         """Read file content with persistence tracking"""
         self._check_allowed(rel_path)
         ap = self._abs(rel_path)
         self.files_accessed.add(rel_path)
-        
-        if not os.path.exists(ap):
+        return self._read_resolved(rel_path, ap, max_bytes)
+    
+    def _read_resolved(self, rel_path: str, ap: str, max_bytes: int = MAX_FILE_READ_BYTES) -> str:
+        """read_text for a path already checked and resolved by _abs"""
+        # Unbuffered fd (non-inheritable by default): a BufferedReader adds syscalls and prefetches past the cutoff
+        try:
+            fd = os.open(ap, os.O_RDONLY)
+        except FileNotFoundError:
             raise RuntimeError(f"File not found: {rel_path}")
-        
-        with open(ap, "rb") as f:
-            b = f.read(max_bytes + 1)
+        try:
+            st = os.fstat(fd)
+            # Reuse content another agent already read if the file hasn't changed since
+            cached = _READ_CACHE.get(ap)
+            if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size and (len(cached[2]) == st.st_size or len(cached[2]) > max_bytes):
+                b = cached[2][:max_bytes + 1]
+                hit = True
+            else:
+                # Size the buffer from fstat (0 means unknown); the extra byte detects truncation
+                b = os.read(fd, min(st.st_size or max_bytes, max_bytes) + 1)
+                hit = False
+        finally:
+            os.close(fd)
+        if not hit:
+            if time.time_ns() - st.st_mtime_ns > _READ_CACHE_MIN_AGE_NS:
+                with _READ_LOCK:
+                    if len(_READ_CACHE) >= READ_CACHE_MAX_FILES:
+                        _READ_CACHE.pop(next(iter(_READ_CACHE)), None)
+                    _READ_CACHE[ap] = (st.st_mtime_ns, st.st_size, b)
         if len(b) > max_bytes:
             return b[:max_bytes].decode("utf-8", errors="replace") + "\n...TRUNCATED..."
         return b.decode("utf-8", errors="replace")
     
-    def read_multiple_files(self, file_paths: List[str]) -> Dict[str, str]:
-        """Read multiple files at once"""
-        results = {}
-        for path in file_paths:
+    def read_text_batch(self, file_paths: List[str], max_bytes: int = MAX_FILE_READ_BYTES) -> Dict[str, Union[str, Exception]]:
+        """Read a batch of files in one submission to the shared read pool; failures map to their exception"""
+        def read_one(path: str) -> Union[str, Exception]:
             try:
-                results[path] = self.read_text(path)
+                return self.read_text(path, max_bytes=max_bytes)
             except Exception as e:
-                results[path] = f"ERROR: {e}"
-        return results
+                return e
+        
+        if len(file_paths) <= 1:
+            return {path: read_one(path) for path in file_paths}
+        return dict(zip(file_paths, _read_pool().map(read_one, file_paths)))
+    
+    def read_multiple_files(self, file_paths: List[str]) -> Dict[str, str]:
+        """Read multiple files at once (concurrently; os.read releases the GIL)"""
+        return {path: content if isinstance(content, str) else f"ERROR: {content}"
+                for path, content in self.read_text_batch(file_paths).items()}
 
     def write_text(self, rel_path: str, content: str, 
                    create_backup: bool = True) -> None:
@@ -84,31 +331,56 @@ class PersistentTools:
         ap = self._abs(rel_path)
         self.files_modified.add(rel_path)
         
-        # Create backup before modification
-        if create_backup and os.path.exists(ap):
+        # Skip the backup and the write when we already wrote exactly this content
+        data = content.encode("utf-8")
+        new_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+        cached = self._last_hash.get(rel_path)
+        if cached and cached[0] == new_hash:
             try:
-                with open(ap, 'r', encoding='utf-8') as f:
-                    old_content = f.read()
-                self.state_manager.save_file_snapshot(rel_path, old_content, self.agent_name)
-            except:
-                pass  # If we can't read old content, continue anyway
+                st = os.stat(ap)
+                if (st.st_size, st.st_mtime_ns) == cached[1:]:
+                    return
+            except OSError:
+                pass
+        
+        # Create backup before modification
+        if create_backup:
+            self._snapshot(rel_path, ap)
         
         os.makedirs(os.path.dirname(ap), exist_ok=True)
-        with open(ap, "w", encoding="utf-8") as f:
-            f.write(content)
+        with open(ap, "wb") as f:
+            f.write(data)
+        st = os.stat(ap)
+        self._last_hash[rel_path] = (new_hash, st.st_size, st.st_mtime_ns)
+        self._invalidate_listing()
     
-    def append_text(self, rel_path: str, content: str) -> None:
+    def _snapshot(self, rel_path: str, ap: str) -> None:
+        """Record the file's current bytes in its history, if it exists"""
+        try:
+            with open(ap, "rb") as f:
+                old = f.read()
+        except OSError:
+            return  # Missing or unreadable: nothing to back up
+        try:
+            self.state_manager.save_file_snapshot(rel_path, old, self.agent_name)
+        except Exception:
+            pass  # A failed backup must not block the write
+    
+    def append_text(self, rel_path: str, content: str, 
+                    create_backup: bool = True) -> None:
         """Append content to a file"""
         self._check_allowed(rel_path)
         ap = self._abs(rel_path)
+        self.files_modified.add(rel_path)
         
-        # Read existing content if file exists
-        existing = ""
-        if os.path.exists(ap):
-            with open(ap, "r", encoding="utf-8") as f:
-                existing = f.read()
+        # Snapshot the current content once, then append only the new bytes
+        if create_backup:
+            self._snapshot(rel_path, ap)
         
-        self.write_text(rel_path, existing + content, create_backup=True)
+        os.makedirs(os.path.dirname(ap), exist_ok=True)
+        with open(ap, "ab") as f:
+            f.write(content.encode("utf-8"))
+        self._invalidate_listing()
     
     def copy_file(self, src_rel_path: str, dest_rel_path: str) -> None:
         """Copy a file within the workspace"""
@@ -122,17 +394,12 @@ class PersistentTools:
             raise RuntimeError(f"Source file not found: {src_rel_path}")
         
         # Create backup of destination if it exists
-        if os.path.exists(dest_abs):
-            try:
-                with open(dest_abs, 'r', encoding='utf-8') as f:
-                    old_content = f.read()
-                self.state_manager.save_file_snapshot(dest_rel_path, old_content, self.agent_name)
-            except:
-                pass
+        self._snapshot(dest_rel_path, dest_abs)
         
         os.makedirs(os.path.dirname(dest_abs), exist_ok=True)
         shutil.copy2(src_abs, dest_abs)
         self.files_modified.add(dest_rel_path)
+        self._invalidate_listing()
     
     def get_file_info(self, rel_path: str) -> Dict[str, Any]:
         """Get metadata about a file"""
@@ -149,40 +416,124 @@ class PersistentTools:
             "is_dir": os.path.isdir(ap)
         }
     
-    def get_file_history(self, rel_path: str) -> List[Dict[str, Any]]:
+    def get_file_history(self, rel_path: str, with_content: bool = True) -> List[Dict[str, Any]]:
         """Get the change history of a file"""
-        return self.state_manager.get_file_history(rel_path)
+        return self.state_manager.get_file_history(rel_path, with_content)
     
-    def search_in_files(self, pattern: str, file_pattern: str = "*.py") -> List[Dict[str, Any]]:
-        """Search for text pattern in files matching file_pattern"""
+    def _search_mapped(self, bpat: "re.Pattern[bytes]", rel_path: str, ap: str, limit: int) -> List[Dict[str, Any]]:
+        """search_in_files over a memory-mapped file; only matched lines are decoded"""
+        results = []
+        self.files_accessed.add(rel_path)
+        fd = os.open(ap, os.O_RDONLY)
+        try:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                n = len(mm)
+                pos, line = 0, 0  # line: newlines before pos
+                while len(results) < limit and pos <= n:
+                    m = bpat.search(mm, pos)
+                    if m is None:
+                        break
+                    line += mm[pos:m.start()].count(b"\n")
+                    line_end = mm.find(b"\n", m.start())
+                    line_end = n if line_end == -1 else line_end
+                    # One result per matching line, and matches stay within their line
+                    pos = line_end + 1
+                    if m.end() > line_end:
+                        m = bpat.search(mm, m.start(), line_end)
+                        if m is None:
+                            line += 1
+                            continue
+                    
+                    # Context: two lines either side of the matching line
+                    ctx_start = mm.rfind(b"\n", 0, m.start()) + 1
+                    for _ in range(2):
+                        if ctx_start == 0:
+                            break
+                        ctx_start = mm.rfind(b"\n", 0, ctx_start - 1) + 1
+                    ctx_end = mm.find(b"\n", m.start())
+                    ctx_end = n if ctx_end == -1 else ctx_end
+                    for _ in range(2):
+                        if ctx_end >= n:
+                            break
+                        nxt = mm.find(b"\n", ctx_end + 1)
+                        ctx_end = n if nxt == -1 else nxt
+                    results.append({
+                        "file": rel_path,
+                        "line": line + 1,
+                        "match": m.group(0).decode("utf-8", errors="replace"),
+                        "context": mm[ctx_start:ctx_end].decode("utf-8", errors="replace")
+                    })
+                    line += 1
+        finally:
+            os.close(fd)
+        return results
+
+    def search_in_files(self, pattern: str, file_pattern: str = "*.py",
+                        max_results: int = MAX_SEARCH_RESULTS,
+                        max_per_file: int = MAX_SEARCH_RESULTS_PER_FILE) -> List[Dict[str, Any]]:
+        """Search for text pattern in files matching file_pattern (at most max_results hits, max_per_file per file)"""
         import fnmatch
         
+        name_match = re.compile(fnmatch.translate(file_pattern)).match
+        try:
+            pat = re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+        except re.error:
+            return []  # As before: an invalid pattern finds nothing
+        bpat = None  # bytes pattern for memory-mapped large files, compiled on first use
         results = []
-        for root, _, files in os.walk(self.workspace_dir):
-            for file in files:
-                if fnmatch.fnmatch(file, file_pattern):
-                    rel_path = os.path.relpath(os.path.join(root, file), self.workspace_dir)
-                    if rel_path.startswith(".agent_state"):
+        for rel_path in self._all_files():
+            if name_match(os.path.basename(rel_path)):
+                try:
+                    ap = self._abs(rel_path)
+                    self._check_allowed(rel_path)
+                    if os.path.getsize(ap) > MMAP_SEARCH_THRESHOLD:
+                        if bpat is None:
+                            bpat = re.compile(pattern.encode("utf-8"), re.IGNORECASE | re.MULTILINE)
+                        results.extend(self._search_mapped(bpat, rel_path, ap, min(max_per_file, max_results - len(results))))
+                        if len(results) >= max_results:
+                            return results
                         continue
                     
-                    try:
-                        content = self.read_text(rel_path)
-                        if re.search(pattern, content, re.IGNORECASE):
-                            # Show context around match
-                            lines = content.split('\n')
-                            for i, line in enumerate(lines):
-                                if re.search(pattern, line, re.IGNORECASE):
-                                    start = max(0, i - 2)
-                                    end = min(len(lines), i + 3)
-                                    context = '\n'.join(lines[start:end])
-                                    results.append({
-                                        "file": rel_path,
-                                        "line": i + 1,
-                                        "match": re.search(pattern, line).group(0),
-                                        "context": context
-                                    })
-                    except Exception as e:
-                        continue
+                    # Already resolved above; read_text would realpath it again
+                    self.files_accessed.add(rel_path)
+                    content = self._read_resolved(rel_path, ap)
+                    newlines = None
+                    pos = 0
+                    file_hits = 0
+                    while file_hits < max_per_file and pos <= len(content):
+                        m = pat.search(content, pos)
+                        if m is None:
+                            break
+                        if newlines is None:
+                            # Offsets of every newline; line k spans (newlines[k-1], newlines[k])
+                            newlines = [nl.start() for nl in _NEWLINE_RE.finditer(content)]
+                            line_count = len(newlines) + 1
+                        i = bisect.bisect_left(newlines, m.start())
+                        line_end = newlines[i] if i < len(newlines) else len(content)
+                        # One result per matching line, and (as when lines were searched one by one)
+                        # a match can't run past its line: retry a spanning one within the line
+                        pos = line_end + 1
+                        if m.end() > line_end:
+                            m = pat.search(content, m.start(), line_end)
+                            if m is None:
+                                continue
+                        file_hits += 1
+                        
+                        # Show context around match
+                        start = max(0, i - 2)
+                        end = min(line_count, i + 3)
+                        ctx_start = newlines[start - 1] + 1 if start else 0
+                        ctx_end = newlines[end - 1] if end - 1 < len(newlines) else len(content)
+                        results.append({
+                            "file": rel_path,
+                            "line": i + 1,
+                            "match": m.group(0),
+                            "context": content[ctx_start:ctx_end]
+                        })
+                        if len(results) >= max_results:
+                            return results
+                except Exception as e:
+                    continue
         
         return results
 
@@ -215,28 +566,18 @@ class PersistentTools:
     def apply_patch(self, patch: Dict[str, Any]) -> None:
         # PATCH schema:
         # {"type":"PATCH","files":[{"path":"x.py","action":"write","content":"..."}]}
-        files = patch.get("files")
-        if not isinstance(files, list):
-            raise RuntimeError("PATCH missing files[]")
-        for item in files:
-            if not isinstance(item, dict):
-                raise RuntimeError("PATCH file entry must be object")
-            path = item.get("path")
-            action = item.get("action")
-            content = item.get("content")
-            if not isinstance(path, str) or not path:
-                raise RuntimeError("PATCH file entry missing path")
-            if action != "write":
-                raise RuntimeError("PATCH supports only action=write in this minimal version")
-            if not isinstance(content, str):
-                raise RuntimeError("PATCH content must be string")
-            self.write_text(path, content)
+        # Validate every entry up front, so a bad entry can't leave the patch half-applied
+        err = self.validate_patch(patch)
+        if err:
+            raise RuntimeError(err)
+        for item in patch["files"]:
+            self.write_text(item["path"], item["content"])
 
     def _check_command_security(self, command: str) -> Optional[str]:
         # 1. Check blacklist
-        for pattern in BLACKLIST_PATTERNS:
-            if re.search(pattern, command):
-                return f"ERROR: Command blocked by blacklist pattern: {pattern}"
+        if _BLACKLIST_RE.search(command):
+            pattern = next(p for p in BLACKLIST_PATTERNS if re.search(p, command))
+            return f"ERROR: Command blocked by blacklist pattern: {pattern}"
 
         # 2. Check whitelist (simple heuristic: first token)
         parts = command.strip().split()
@@ -244,13 +585,24 @@ class PersistentTools:
             return "ERROR: Empty command"
         
         base_cmd = parts[0]
-        # Allow running local scripts like "./script.py" or "python script.py"
-        is_local_script = base_cmd.startswith("./") or base_cmd.endswith(".py") or base_cmd.endswith(".sh")
-        
-        if base_cmd not in ALLOWED_COMMANDS and not is_local_script:
+        # Allow running local scripts like "./script.py" or "python script.py" (only tested off the whitelist)
+        if base_cmd not in ALLOWED_COMMANDS and not (base_cmd.startswith("./") or base_cmd.endswith((".py", ".sh"))):
              return f"ERROR: Command '{base_cmd}' not in allowed list."
         return None
 
+    def _argv(self, command: str) -> Optional[List[str]]:
+        """Split a plain command into argv, or None if it needs a shell"""
+        if _SHELL_META_RE.search(command):
+            return None
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+        # Local scripts may lack a shebang, which only the shell tolerates
+        if not argv or "=" in argv[0] or "/" in argv[0] or argv[0].endswith((".py", ".sh")):
+            return None
+        return argv
+    
     def run_shell_structured(self, command: str) -> Dict[str, Any]:
         """
         Run a shell command and return structured output.
@@ -261,7 +613,7 @@ class PersistentTools:
             "timed_out": bool
         }
         """
-        print("[DEBUG] EXECUTING (structured):", command, file=sys.stderr)
+        log.debug("EXECUTING (structured): %s", command)
 
         security_error = self._check_command_security(command)
         if security_error:
@@ -272,12 +624,12 @@ class PersistentTools:
                 "timed_out": False
             }
 
-        is_background = bool(re.search(r"(^|\s)&\s*$", command.strip()))
+        is_background = _BACKGROUND_RE.search(command.strip()) is not None
 
         try:
             if is_background:
                 proc = subprocess.Popen(
-                    ["bash", "-lc", f"{command} echo __PID__=$!"],
+                    ["bash", "-c", f"{command} echo __PID__=$!"],
                     cwd=self.workspace_dir,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.STDOUT, # Merge stderr for background (legacy behavior, or keep separate?)
@@ -302,15 +654,33 @@ class PersistentTools:
                         "timed_out": True
                     }
 
-            # Normal (foreground) command
-            res = subprocess.run(
-                command, 
-                shell=True,
-                cwd=self.workspace_dir, 
-                capture_output=True,
-                timeout=SHELL_TIMEOUT,
-                text=True
-            )
+            # Normal (foreground) command; plain ones skip the /bin/sh hop
+            argv = self._argv(command)
+            if argv is None and USE_PERSISTENT_SHELL and not _SHELL_STATE_RE.search(command):
+                code, out, err = _persistent_shell(self.workspace_dir).run(command, SHELL_TIMEOUT)
+                return {
+                    "exit_code": code,
+                    "stdout": out,
+                    "stderr": err,
+                    "timed_out": False
+                }
+            try:
+                res = subprocess.run(
+                    argv if argv is not None else command,
+                    shell=argv is None,
+                    cwd=self.workspace_dir,
+                    capture_output=True,
+                    timeout=SHELL_TIMEOUT,
+                    text=True
+                )
+            except FileNotFoundError:
+                # What /bin/sh reports for an unknown command
+                return {
+                    "exit_code": 127,
+                    "stdout": "",
+                    "stderr": f"{argv[0]}: command not found",
+                    "timed_out": False
+                }
             return {
                 "exit_code": res.returncode,
                 "stdout": res.stdout or "",
@@ -1,7 +1,15 @@
+import sys
 import time
+from collections import deque
 from enum import Enum, auto
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from ._json import dumps_text
+from .config import CONTEXT_HISTORY
+
+# __slots__ instances where dataclass supports it (3.10+): smaller, faster attribute access
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 class State(Enum):
     SPEC = auto()
@@ -16,7 +24,7 @@ class State(Enum):
     DONE = auto()
     FAILED = auto()
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class TaskPacket:
     objective: str
     workspace_dir: str = "."
@@ -24,19 +32,76 @@ class TaskPacket:
     files_allowed: Tuple[str, ...] = ()
     task_id: str = field(default_factory=lambda: f"task_{int(time.time())}")
 
-@dataclass
+@dataclass(**_SLOTS)
 class RunContext:
     packet: TaskPacket
+    # frozen_spec, plan, spec_review and patch_review are replaced, never mutated in place:
+    # their JSON is memoized by identity (_memo_json, StateManager._encode_context)
     frozen_spec: Optional[Dict[str, Any]] = None
     plan: Optional[Dict[str, Any]] = None
-    patches: List[Dict[str, Any]] = field(default_factory=list)
-    test_reports: List[Dict[str, Any]] = field(default_factory=list)
+    patches: Deque[Dict[str, Any]] = field(default_factory=lambda: deque(maxlen=CONTEXT_HISTORY))
+    test_reports: Deque[Dict[str, Any]] = field(default_factory=lambda: deque(maxlen=CONTEXT_HISTORY))
+    # Patches / test reports produced over the task's lifetime (artifact names stay unique)
+    patch_seq: int = 0
+    report_seq: int = 0
     
     # State machine transient data
     spec_review: Optional[Dict[str, Any]] = None
     patch_review: Optional[Dict[str, Any]] = None
     latest_research_report: Optional[str] = None
+    # 2KB head+tail implementation-file previews shared between agents (not persisted)
+    file_previews: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
+    # URL -> verifier report for this task (persisted as the url_reports artifact)
+    url_reports: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
     
     # Add state tracking
     current_state: State = State.SPEC
     iteration_count: int = 0
+    
+    # Prompt JSON memo: key -> (object it was serialized from, JSON text)
+    _json_memo: Dict[str, Tuple[Any, str]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    
+    def _memo_json(self, key: str, obj: Any, view: Optional[Callable[[Any], Any]] = None) -> str:
+        hit = self._json_memo.get(key)
+        if hit is None or hit[0] is not obj:
+            hit = self._json_memo[key] = (obj, dumps_text(view(obj) if view else obj))
+        return hit[1]
+    
+    def invalidate_previews(self, paths: Optional[List[str]] = None) -> None:
+        """Drop cached previews for paths (all of them if None)"""
+        if paths is None:
+            self.file_previews.clear()
+        else:
+            for path in paths:
+                self.file_previews.pop(path, None)
+    
+    def spec_json(self) -> str:
+        """frozen_spec as JSON text, re-serialized only when the spec is replaced"""
+        return self._memo_json("frozen_spec", self.frozen_spec)
+    
+    def last_patch_json(self) -> str:
+        """patches[-1] as JSON text, re-serialized only when a new patch is appended"""
+        return self._memo_json("last_patch", self.patches[-1])
+    
+    def last_patch_summary_json(self, max_chars: int) -> str:
+        """patches[-1] as JSON with file bodies longer than max_chars cut to a head (for agents that can read files)"""
+        return self._memo_json(f"last_patch_summary:{max_chars}", self.patches[-1],
+                               lambda patch: summarize_patch(patch, max_chars))
+
+
+def snippet(content: str, n: int) -> str:
+    """content, or its first and last n chars when longer than 2*n"""
+    if len(content) <= 2 * n:
+        return content
+    return content[:n] + f"\n...[{len(content) - 2 * n} chars elided]...\n" + content[-n:]
+
+
+def summarize_patch(patch: Dict[str, Any], max_chars: int) -> Dict[str, Any]:
+    """Copy of patch whose long file contents are cut to max_chars plus a note"""
+    files = []
+    for f in patch.get("files", []):
+        content = f.get("content")
+        if isinstance(content, str) and len(content) > max_chars:
+            f = dict(f, content=content[:max_chars] + f"\n...[{len(content) - max_chars} more chars; applied on disk, read the file for the rest]")
+        files.append(f)
+    return dict(patch, files=files)